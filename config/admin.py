@@ -1,37 +1,46 @@
 import inspect
 
 from django.contrib import admin
-from django.contrib.sites.shortcuts import get_current_site
 from django.db import models
 from django.http import HttpRequest
 
-from sites.models import SiteAttributes
+from sites.utils import get_site_entry
 
 
 class DynamicAdminSite(admin.AdminSite):
-    def get_app_list(self, request: HttpRequest, *args, **kwargs):
+    def each_context(self, request: HttpRequest):
+        """
+        Brand the admin with the current site's name. Resolved per request,
+        and only for admin pages, instead of on the shared admin site.
+        """
+        context = super().each_context(request)
+        site_entry = get_site_entry(request)
+        if site_entry is not None:
+            context["site_header"] = f"{site_entry.site.name} Admin"
+            context["site_title"] = f"{site_entry.site.name} Admin"
+        return context
+
+    def get_app_list(self, request: HttpRequest, app_label=None):
         """
         Return a list of applications and models that are available for the
         current site.
         """
-        app_list = super().get_app_list(request, *args, **kwargs)
-        current_site = get_current_site(request)
-
-        if not current_site:
-            return app_list
-
-        site_attributes = SiteAttributes.objects.filter(site=current_site).first()
-        if not site_attributes or not site_attributes.admin_app_labels:
-            return app_list
-
-        allowed_app_labels = {
-            app_label
-            for app_label in site_attributes.admin_app_labels
-            if isinstance(app_label, str) and app_label.strip()
-        }
-        return [
-            app for app in app_list if app["app_label"] in allowed_app_labels
-        ]
+        site_entry = get_site_entry(request)
+        if site_entry is None or site_entry.admin_app_labels is None:
+            return super().get_app_list(request, app_label)
+
+        # Only build entries for allowed apps rather than filtering the full
+        # list afterwards; this mirrors AdminSite.get_app_list.
+        allowed_app_labels = site_entry.admin_app_labels
+        if app_label is not None:
+            allowed_app_labels &= {app_label}
+        app_dict = {}
+        for label in allowed_app_labels:
+            app_dict.update(self._build_app_dict(request, label))
+        app_list = sorted(app_dict.values(), key=lambda app: app["name"].lower())
+        for app in app_list:
+            app["models"].sort(key=lambda model: model["name"])
+        return app_list
 
 
 def auto_register_models(app_models):
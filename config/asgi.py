@@ -17,6 +17,13 @@ from channels.security.websocket import AllowedHostsOriginValidator
 from django.core.asgi import get_asgi_application
 
 import users.routing
+from config.db import (
+    arelease_database_connections,
+    close_database_pool,
+    open_database_pool,
+)
+from config.handlers import LeanASGIHandler, route_by_middleware_profile
+from config.http import close_http_client, open_http_client
 from config.installed_apps import get_installed_apps
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
@@ -26,6 +33,14 @@ logger = structlog.get_logger(__name__)
 
 django_asgi_app = get_asgi_application()
 
+# Imported after Django setup because they load models.
+from sites.early_hints import EarlyHintsMiddleware  # noqa: E402
+from sites.invalidation import (  # noqa: E402
+    start_site_invalidation_listener,
+    stop_site_invalidation_listener,
+)
+from sites.utils import aget_site_snapshot  # noqa: E402
+
 # Collect websocket patterns from enabled sites
 all_websocket_patterns = [
     *users.routing.websocket_urlpatterns,
@@ -40,9 +55,49 @@ for app in get_installed_apps():
         pass
 
 
+async def _warm_site_snapshot() -> None:
+    # Best-effort: if the database is down at boot, requests load the snapshot
+    # once it is back.
+    try:
+        await aget_site_snapshot()
+        await arelease_database_connections()
+    except Exception:
+        logger.exception("Could not warm the site snapshot at startup")
+
+
+async def lifespan_app(scope, receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await open_http_client()
+                await open_database_pool()
+                # Listen before warming up so edits made meanwhile still
+                # reach this worker.
+                await start_site_invalidation_listener()
+            except Exception as exc:
+                # Report the failure rather than raising: in "auto" mode
+                # uvicorn would disable lifespan and serve without the
+                # listener or the shutdown hooks.
+                logger.exception("Startup failed")
+                await send({"type": "lifespan.startup.failed", "message": str(exc)})
+                return
+            await _warm_site_snapshot()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await stop_site_invalidation_listener()
+            await close_http_client()
+            await close_database_pool()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
 application = ProtocolTypeRouter(
     {
-        "http": django_asgi_app,
+        "lifespan": lifespan_app,
+        "http": EarlyHintsMiddleware(
+            route_by_middleware_profile(django_asgi_app, LeanASGIHandler())
+        ),
         "websocket": AllowedHostsOriginValidator(
             AuthMiddlewareStack(URLRouter(all_websocket_patterns))
         ),
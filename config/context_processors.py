@@ -1,9 +1,9 @@
-from django.contrib.sites.shortcuts import get_current_site
+from sites.utils import get_site_entry
 
 
 def global_settings(request):
-    current_site = get_current_site(request)
-    product_name = current_site.name if current_site is not None else ""
+    site_entry = get_site_entry(request)
+    product_name = site_entry.site.name if site_entry is not None else ""
     return {
         "product_name": product_name,
     }
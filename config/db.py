@@ -0,0 +1,97 @@
+from typing import NamedTuple
+
+import structlog
+from asgiref.sync import sync_to_async
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+
+logger = structlog.get_logger(__name__)
+
+
+class DatabasePoolStats(NamedTuple):
+    size: int
+    available: int
+    min_size: int
+    max_size: int
+    waiting: int
+    requests: int
+    wait_ms: int
+    errors: int
+
+    @property
+    def utilization(self) -> float:
+        return (self.size - self.available) / self.max_size if self.max_size else 0.0
+
+    @property
+    def average_wait_ms(self) -> float:
+        return self.wait_ms / self.requests if self.requests else 0.0
+
+
+def get_database_pool(alias=DEFAULT_DB_ALIAS):
+    """The psycopg pool for the alias, or None if it is not pooled."""
+    # Only the PostgreSQL backend has a pool attribute; it is None unless
+    # OPTIONS["pool"] is set. Pools are shared by all threads of the process.
+    return getattr(connections[alias], "pool", None)
+
+
+def get_database_pool_stats(alias=DEFAULT_DB_ALIAS) -> DatabasePoolStats | None:
+    pool = get_database_pool(alias)
+    if pool is None:
+        return None
+    stats = pool.get_stats()
+    return DatabasePoolStats(
+        size=stats.get("pool_size", 0),
+        available=stats.get("pool_available", 0),
+        min_size=stats.get("pool_min", 0),
+        max_size=stats.get("pool_max", 0),
+        waiting=stats.get("requests_waiting", 0),
+        requests=stats.get("requests_num", 0),
+        wait_ms=stats.get("requests_wait_ms", 0),
+        errors=stats.get("requests_errors", 0),
+    )
+
+
+def database_pool_log_fields(alias=DEFAULT_DB_ALIAS) -> dict[str, float | int]:
+    stats = get_database_pool_stats(alias)
+    if stats is None:
+        return {}
+    return {
+        "db_pool_size": stats.size,
+        "db_pool_available": stats.available,
+        "db_pool_waiting": stats.waiting,
+        "db_pool_utilization": round(stats.utilization, 2),
+    }
+
+
+async def open_database_pool() -> None:
+    pool = get_database_pool()
+    if pool is None:
+        return
+    # Fills up to min_size in psycopg's own threads without blocking startup.
+    pool.open(wait=False)
+    logger.info(
+        "Opened database connection pool",
+        min_size=pool.min_size,
+        max_size=pool.max_size,
+        max_lifetime=pool.max_lifetime,
+        timeout=pool.timeout,
+    )
+
+
+async def close_database_pool() -> None:
+    if get_database_pool() is None:
+        return
+    logger.info(
+        "Closing database connection pool", **get_database_pool_stats()._asdict()
+    )
+    # Closing joins the pool's worker threads, so keep it off the event loop.
+    await sync_to_async(connections[DEFAULT_DB_ALIAS].close_pool)()
+
+
+async def arelease_database_connections() -> None:
+    """
+    Give back connections opened by async ORM calls made outside a request,
+    such as at startup or in a background listener. Django only does this at
+    the end of a request, and a pooled connection that is never closed stays
+    checked out for the life of the worker.
+    """
+    await sync_to_async(close_old_connections)()
@@ -3,12 +3,12 @@ from email.mime.base import MIMEBase
 
 import resend
 from django.contrib.sites.models import Site
-from django.contrib.sites.shortcuts import get_current_site
 from django.core.mail.backends.base import BaseEmailBackend
 from django.core.mail.message import EmailAttachment, EmailMessage
 
+from config.timing import timed_phase
 from sites.models import SiteAttributes
-from sites.utils import get_current_site_attributes
+from sites.utils import get_site_entry
 
 
 def format_from_email(display_name: str, from_email: str) -> str:
@@ -16,11 +16,11 @@ def format_from_email(display_name: str, from_email: str) -> str:
 
 
 def get_request_from_email(request) -> str:
-    site = get_current_site(request)
-    site_attributes = get_current_site_attributes(request)
-    if site is None:
+    site_entry = get_site_entry(request)
+    if site_entry is None:
         msg = "Current site is required to determine the from email address."
         raise ValueError(msg)
+    site, site_attributes = site_entry.site, site_entry.attributes
     if site_attributes is None:
         msg = (
             "Current site attributes are required to determine the from email address."
@@ -54,7 +54,8 @@ class ResendEmailBackend(BaseEmailBackend):
             if not email_message.recipients():
                 continue
             try:
-                resend.Emails.send(self._build_send_params(email_message))
+                with timed_phase("email"):
+                    resend.Emails.send(self._build_send_params(email_message))
             except Exception:
                 if not self.fail_silently:
                     raise
@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.exception import convert_exception_to_response
+from django.utils.module_loading import import_string
+
+
+class LeanASGIHandler(ASGIHandler):
+    """ASGI handler built from settings.LEAN_MIDDLEWARE instead of MIDDLEWARE."""
+
+    def load_middleware(self, is_async=False):  # noqa: FBT002
+        # BaseHandler.load_middleware with the chain taken from LEAN_MIDDLEWARE,
+        # so settings.MIDDLEWARE is never swapped under other handlers.
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+
+        get_response = self._get_response_async if is_async else self._get_response
+        handler = convert_exception_to_response(get_response)
+        handler_is_async = is_async
+        for middleware_path in reversed(settings.LEAN_MIDDLEWARE):
+            middleware = import_string(middleware_path)
+            middleware_can_sync = getattr(middleware, "sync_capable", True)
+            middleware_can_async = getattr(middleware, "async_capable", False)
+            if not middleware_can_sync and not middleware_can_async:
+                msg = (
+                    f"Middleware {middleware_path} must have at least one of "
+                    "sync_capable/async_capable set to True."
+                )
+                raise RuntimeError(msg)
+            if not handler_is_async and middleware_can_sync:
+                middleware_is_async = False
+            else:
+                middleware_is_async = middleware_can_async
+            try:
+                adapted_handler = self.adapt_method_mode(
+                    middleware_is_async,
+                    handler,
+                    handler_is_async,
+                    debug=settings.DEBUG,
+                    name=f"middleware {middleware_path}",
+                )
+                mw_instance = middleware(adapted_handler)
+            except MiddlewareNotUsed:
+                continue
+            if mw_instance is None:
+                msg = f"Middleware factory {middleware_path} returned None."
+                raise ImproperlyConfigured(msg)
+
+            if hasattr(mw_instance, "process_view"):
+                self._view_middleware.insert(
+                    0, self.adapt_method_mode(is_async, mw_instance.process_view)
+                )
+            if hasattr(mw_instance, "process_template_response"):
+                self._template_response_middleware.append(
+                    self.adapt_method_mode(
+                        is_async, mw_instance.process_template_response
+                    )
+                )
+            if hasattr(mw_instance, "process_exception"):
+                self._exception_middleware.append(
+                    self.adapt_method_mode(False, mw_instance.process_exception)  # noqa: FBT003
+                )
+
+            handler = convert_exception_to_response(mw_instance)
+            handler_is_async = middleware_is_async
+
+        handler = self.adapt_method_mode(is_async, handler, handler_is_async)
+        self._middleware_chain = handler
+
+
+def route_by_middleware_profile(app, lean_app, prefixes=None):
+    """Send HTTP requests under settings.LEAN_ROUTE_PREFIXES to lean_app."""
+    if prefixes is None:
+        prefixes = tuple(settings.LEAN_ROUTE_PREFIXES)
+
+    async def router(scope, receive, send):
+        if scope["path"].startswith(prefixes):
+            return await lean_app(scope, receive, send)
+        return await app(scope, receive, send)
+
+    return router
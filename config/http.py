@@ -0,0 +1,138 @@
+import asyncio
+import os
+import time
+from typing import NamedTuple
+
+import httpx
+import structlog
+
+from config.timing import request_timings
+
+logger = structlog.get_logger(__name__)
+
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "2"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "5"))
+HTTP_POOL_MAX_CONNECTIONS = int(os.environ.get("HTTP_POOL_MAX_CONNECTIONS", "100"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.environ.get("HTTP_POOL_MAX_KEEPALIVE", "20"))
+HTTP_POOL_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_POOL_KEEPALIVE_EXPIRY", "60"))
+
+
+class HTTPPoolStats(NamedTuple):
+    connections: int
+    idle: int
+    active: int
+    http2: int
+    requests: int
+
+
+# One pooled client per worker event loop. Under uvicorn it is opened and closed
+# by the ASGI lifespan hooks in config/asgi.py; elsewhere (runserver, tests) it is
+# created lazily and replaced whenever it is used from a different event loop.
+_client: httpx.AsyncClient | None = None
+_client_loop: asyncio.AbstractEventLoop | None = None
+_request_count = 0
+# Strong references so closing replaced clients is not garbage collected mid-flight.
+_closing_clients: set[asyncio.Task] = set()
+
+
+async def _count_request(request: httpx.Request) -> None:
+    global _request_count  # noqa: PLW0603
+    _request_count += 1
+    request.extensions["timing_started"] = time.perf_counter()
+
+
+async def _time_response(response: httpx.Response) -> None:
+    timings = request_timings.get()
+    if timings is not None:
+        started = response.request.extensions["timing_started"]
+        timings.record("http", time.perf_counter() - started)
+
+
+def create_http_client(
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=True,
+        transport=transport,
+        timeout=httpx.Timeout(
+            HTTP_READ_TIMEOUT,
+            connect=HTTP_CONNECT_TIMEOUT,
+        ),
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_POOL_KEEPALIVE_EXPIRY,
+        ),
+        event_hooks={"request": [_count_request], "response": [_time_response]},
+    )
+
+
+async def _aclose_replaced_client(client: httpx.AsyncClient) -> None:
+    try:
+        await client.aclose()
+    except Exception:
+        # Its loop is gone; the sockets are closed when they are collected.
+        logger.debug("Could not close replaced HTTP client", exc_info=True)
+
+
+def _close_replaced_client(
+    client: httpx.AsyncClient, loop: asyncio.AbstractEventLoop
+) -> None:
+    # Connections belong to the loop they were opened on, so close them there
+    # if it still runs (in another thread).
+    if loop.is_running():
+        asyncio.run_coroutine_threadsafe(_aclose_replaced_client(client), loop)
+        return
+    task = asyncio.get_running_loop().create_task(_aclose_replaced_client(client))
+    _closing_clients.add(task)
+    task.add_done_callback(_closing_clients.discard)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _client, _client_loop  # noqa: PLW0603
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        if _client is not None:
+            _close_replaced_client(_client, _client_loop)
+        _client = create_http_client()
+        _client_loop = loop
+    return _client
+
+
+async def open_http_client() -> None:
+    get_http_client()
+    logger.info(
+        "Opened shared HTTP client",
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+        max_connections=HTTP_POOL_MAX_CONNECTIONS,
+    )
+
+
+async def close_http_client() -> None:
+    global _client, _client_loop  # noqa: PLW0603
+    if _client is None:
+        return
+    logger.info("Closing shared HTTP client", **get_http_pool_stats()._asdict())
+    await _client.aclose()
+    _client = None
+    _client_loop = None
+
+
+def get_http_pool_stats() -> HTTPPoolStats:
+    if _client is None:
+        return HTTPPoolStats(
+            connections=0, idle=0, active=0, http2=0, requests=_request_count
+        )
+    # Private httpx attributes, so missing ones (after an upgrade, or with custom
+    # transports such as httpx.MockTransport) count as no pool.
+    transport = getattr(_client, "_transport", None)
+    connections = getattr(getattr(transport, "_pool", None), "connections", [])
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return HTTPPoolStats(
+        connections=len(connections),
+        idle=idle,
+        active=len(connections) - idle,
+        http2=sum(1 for connection in connections if "HTTP/2" in connection.info()),
+        requests=_request_count,
+    )
@@ -1,53 +1,379 @@
-from asgiref.sync import (
-    iscoroutinefunction,
-    sync_to_async,
-)
-from django.contrib import admin
-from django.contrib.sites.models import SITE_CACHE
-from django.contrib.sites.shortcuts import get_current_site
+import hmac
+import os
+
+import structlog
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import middleware as auth_middleware
+from django.contrib.messages import middleware as messages_middleware
+from django.contrib.sessions import middleware as sessions_middleware
+from django.core.exceptions import ImproperlyConfigured
+from django.middleware import clickjacking, common, csrf, security
 from django.utils.decorators import sync_and_async_middleware
+from django.utils.functional import empty
+
+from config.db import database_pool_log_fields
+from config.queries import (
+    QueryBudgetExceededError,
+    get_view_query_budget,
+    query_budget_problems,
+    query_source,
+    record_queries,
+)
+from config.routers import (
+    PRIMARY_PIN_COOKIE,
+    PRIMARY_PIN_SECONDS,
+    ReplicaReads,
+    replica_reads,
+)
+from config.timing import (
+    TIMING_LOG_KEYS,
+    RequestTimings,
+    request_timings,
+    timed_phase,
+)
+from sites.utils import aget_site_entry, get_site_entry
+
+logger = structlog.get_logger(__name__)
 
+# Requests carrying this value in X-Server-Timing-Token get the Server-Timing
+# header even when not signed in as staff.
+SERVER_TIMING_TOKEN = os.environ.get("SERVER_TIMING_TOKEN", "")
 
-def _set_admin_headers(site):
-    if site is not None:
-        admin.site.site_header = f"{site.name} Admin"
-        admin.site.site_title = f"{site.name} Admin"
+
+def _has_server_timing_token(request) -> bool:
+    token = request.headers.get("X-Server-Timing-Token", "")
+    return bool(SERVER_TIMING_TOKEN) and hmac.compare_digest(token, SERVER_TIMING_TOKEN)
+
+
+def _show_server_timing(request) -> bool:
+    """
+    Token holders, and staff if the request already loaded its user. Loading it
+    here would add a session and a user query to every request.
+    """
+    if _has_server_timing_token(request):
+        return True
+    user = getattr(request, "_acached_user", None) or getattr(request, "user", None)
+    # AuthenticationMiddleware's lazy user, never evaluated; DRF authentication
+    # replaces it with the user it authenticated.
+    if user is None or getattr(user, "_wrapped", None) is empty:
+        return False
+    return user.is_staff
+
+
+def _finish_request_timings(request, response, timings, *, show_server_timing):
+    timings.finish()
+    fields = timings.log_fields()
+    structlog.contextvars.bind_contextvars(**fields)
+    logger.info(
+        "Request finished",
+        method=request.method,
+        path=request.path,
+        status_code=response.status_code,
+        **database_pool_log_fields(),
+    )
+    if show_server_timing:
+        response.headers["Server-Timing"] = timings.server_timing()
+    return response
 
 
 @sync_and_async_middleware
-def admin_name_middleware(get_response):
+def server_timing_middleware(get_response):
+    """
+    Time the request by phase (middleware, view, database, cache and outbound
+    calls), log the numbers and, for holders of SERVER_TIMING_TOKEN or staff
+    whose user the request loaded anyway, return them in a Server-Timing
+    header. Also names the request as the source
+    of its slow queries. Must be the outermost middleware.
+    """
     if iscoroutinefunction(get_response):
 
         async def async_impl(request):
-            host = request.get_host()
-            if host in SITE_CACHE:
-                site = SITE_CACHE[host]
-            else:
-                site = await sync_to_async(get_current_site)(request)
-            _set_admin_headers(site)
-            response = await get_response(request)
+            structlog.contextvars.unbind_contextvars(*TIMING_LOG_KEYS)
+            timings = RequestTimings()
+            token = request_timings.set(timings)
+            source_token = query_source.set(request)
+            try:
+                response = await get_response(request)
+            finally:
+                request_timings.reset(token)
+                query_source.reset(source_token)
+            return _finish_request_timings(
+                request,
+                response,
+                timings,
+                show_server_timing=_show_server_timing(request),
+            )
+
+        return async_impl
+
+    def sync_impl(request):
+        structlog.contextvars.unbind_contextvars(*TIMING_LOG_KEYS)
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        source_token = query_source.set(request)
+        try:
+            response = get_response(request)
+        finally:
+            request_timings.reset(token)
+            query_source.reset(source_token)
+        return _finish_request_timings(
+            request, response, timings, show_server_timing=_show_server_timing(request)
+        )
+
+    return sync_impl
+
+
+def _check_query_budget(request, recorder):
+    view_budget = get_view_query_budget(request)
+    if view_budget is None:
+        return
+    view_name, max_queries = view_budget
+    match = request.resolver_match
+    problems = query_budget_problems(
+        recorder,
+        max_queries=max_queries,
+        repeat_limit=getattr(match.func.cls, "query_repeat_limit", 1),
+    )
+    if not problems:
+        return
+    if settings.QUERY_BUDGET_MODE == "raise":
+        msg = f"{view_name} exceeded its query budget:\n" + "\n".join(problems)
+        raise QueryBudgetExceededError(msg)
+    logger.warning(
+        "Query budget exceeded", view=view_name, path=request.path, problems=problems
+    )
+
+
+@sync_and_async_middleware
+def query_budget_middleware(get_response):
+    """
+    Check the queries of DRF views declaring query_budget against it, and flag
+    query shapes they repeat (N+1). QUERY_BUDGET_MODE is "off", "log" (e.g.
+    staging) or "raise" (tests). Goes just before view_timing_middleware.
+    """
+    if iscoroutinefunction(get_response):
+
+        async def async_impl(request):
+            if settings.QUERY_BUDGET_MODE == "off":
+                return await get_response(request)
+            with record_queries() as recorder:
+                response = await get_response(request)
+            _check_query_budget(request, recorder)
             return response
 
         return async_impl
 
     def sync_impl(request):
-        site = get_current_site(request)
-        _set_admin_headers(site)
-        response = get_response(request)
+        if settings.QUERY_BUDGET_MODE == "off":
+            return get_response(request)
+        with record_queries() as recorder:
+            response = get_response(request)
+        _check_query_budget(request, recorder)
         return response
 
     return sync_impl
 
 
-class AllowIframeMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
+@sync_and_async_middleware
+def view_timing_middleware(get_response):
+    """Record the view phase for server_timing_middleware. Must be last."""
+    if iscoroutinefunction(get_response):
+
+        async def async_impl(request):
+            with timed_phase("view"):
+                return await get_response(request)
+
+        return async_impl
+
+    def sync_impl(request):
+        with timed_phase("view"):
+            return get_response(request)
+
+    return sync_impl
+
+
+@sync_and_async_middleware
+def site_snapshot_middleware(get_response):
+    """
+    Attach the request's site and attributes from the site snapshot as
+    request.site_entry, so later middleware and views share one lookup.
+    """
+    if iscoroutinefunction(get_response):
+
+        async def async_impl(request):
+            await aget_site_entry(request)
+            return await get_response(request)
+
+        return async_impl
+
+    def sync_impl(request):
+        get_site_entry(request)
+        return get_response(request)
+
+    return sync_impl
+
 
-    def __call__(self, request):
-        response = self.get_response(request)
+def _pin_primary_after_write(reads, response):
+    if reads.wrote:
+        response.set_cookie(
+            PRIMARY_PIN_COOKIE,
+            "1",
+            max_age=PRIMARY_PIN_SECONDS,
+            secure=settings.SESSION_COOKIE_SECURE,
+            httponly=True,
+            samesite="Lax",
+        )
+    return response
 
-        # Only apply for localhost
+
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    """
+    Let config.routers.ReplicaRouter send the reads of GET, HEAD and OPTIONS
+    requests to replicas; other methods read and write the primary. A request
+    that writes gets a short-lived cookie that keeps the client's next requests
+    on the primary until replicas have caught up.
+    """
+    if iscoroutinefunction(get_response):
+
+        async def async_impl(request):
+            reads = ReplicaReads.for_request(request)
+            token = replica_reads.set(reads)
+            try:
+                response = await get_response(request)
+            finally:
+                replica_reads.reset(token)
+            return _pin_primary_after_write(reads, response)
+
+        return async_impl
+
+    def sync_impl(request):
+        reads = ReplicaReads.for_request(request)
+        token = replica_reads.set(reads)
+        try:
+            response = get_response(request)
+        finally:
+            replica_reads.reset(token)
+        return _pin_primary_after_write(reads, response)
+
+    return sync_impl
+
+
+@sync_and_async_middleware
+def allow_iframe_middleware(get_response):
+    """Allow framing the site when served from localhost (debug only)."""
+
+    def allow_localhost_iframe(request, response):
         if request.get_host().startswith("localhost"):
             response.headers["X-Frame-Options"] = "ALLOWALL"
+        return response
+
+    if iscoroutinefunction(get_response):
+
+        async def async_impl(request):
+            return allow_localhost_iframe(request, await get_response(request))
+
+        return async_impl
+
+    def sync_impl(request):
+        return allow_localhost_iframe(request, get_response(request))
+
+    return sync_impl
 
+
+class EventLoopMiddlewareMixin:
+    """
+    Run a Django MiddlewareMixin's hooks directly on the event loop for async
+    requests, instead of one sync_to_async thread hop per hook. Only for hooks
+    that do no blocking I/O; view_needs_thread() and response_needs_thread()
+    send the exceptions to a thread as before.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if self.async_mode and hasattr(self, "process_view"):
+            # The handler adapts sync process_view hooks with sync_to_async.
+            sync_process_view = self.process_view
+
+            async def process_view(request, callback, *args):
+                if self.view_needs_thread(request, callback):
+                    return await sync_to_async(
+                        sync_process_view, thread_sensitive=True
+                    )(request, callback, *args)
+                return sync_process_view(request, callback, *args)
+
+            self.process_view = process_view
+
+    def view_needs_thread(self, request, callback) -> bool:
+        return False
+
+    def response_needs_thread(self, request, response) -> bool:
+        return False
+
+    async def __acall__(self, request):
+        response = None
+        if hasattr(self, "process_request"):
+            response = self.process_request(request)
+        response = response or await self.get_response(request)
+        if hasattr(self, "process_response"):
+            if self.response_needs_thread(request, response):
+                response = await sync_to_async(
+                    self.process_response, thread_sensitive=True
+                )(request, response)
+            else:
+                response = self.process_response(request, response)
         return response
+
+
+class SecurityMiddleware(EventLoopMiddlewareMixin, security.SecurityMiddleware):
+    pass
+
+
+class CommonMiddleware(EventLoopMiddlewareMixin, common.CommonMiddleware):
+    pass
+
+
+class XFrameOptionsMiddleware(
+    EventLoopMiddlewareMixin, clickjacking.XFrameOptionsMiddleware
+):
+    pass
+
+
+class AuthenticationMiddleware(
+    EventLoopMiddlewareMixin, auth_middleware.AuthenticationMiddleware
+):
+    pass
+
+
+class SessionMiddleware(EventLoopMiddlewareMixin, sessions_middleware.SessionMiddleware):
+    def response_needs_thread(self, request, response) -> bool:
+        # Only saving the session touches the session store.
+        session = getattr(request, "session", None)
+        return session is not None and (
+            session.modified or settings.SESSION_SAVE_EVERY_REQUEST
+        )
+
+
+class MessageMiddleware(EventLoopMiddlewareMixin, messages_middleware.MessageMiddleware):
+    def response_needs_thread(self, request, response) -> bool:
+        # Storing messages can load them from the session first.
+        storage = getattr(request, "_messages", None)
+        return storage is not None and (storage.used or storage.added_new)
+
+
+class CsrfViewMiddleware(EventLoopMiddlewareMixin, csrf.CsrfViewMiddleware):
+    def __init__(self, get_response):
+        if settings.CSRF_USE_SESSIONS:
+            msg = "config.middlewares.CsrfViewMiddleware needs cookie-based CSRF."
+            raise ImproperlyConfigured(msg)
+        super().__init__(get_response)
+
+    def view_needs_thread(self, request, callback) -> bool:
+        # Checking an unsafe request reads request.POST, which parses (and for
+        # uploads spools) the body, and a rejection renders the failure view.
+        # Safe methods and exempt views, such as all DRF views, only read
+        # cookies and headers.
+        if request.method in {"GET", "HEAD", "OPTIONS", "TRACE"}:
+            return False
+        return not getattr(callback, "csrf_exempt", False)
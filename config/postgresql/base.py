@@ -0,0 +1,15 @@
+from django.db.backends.postgresql import base
+
+from config.timing import timed_phase
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL backend that records connection setup in the request timings.
+    With a pool configured this is the time spent waiting for a free
+    connection, so pool exhaustion shows up per request.
+    """
+
+    def get_new_connection(self, conn_params):
+        with timed_phase("db_connect"):
+            return super().get_new_connection(conn_params)
@@ -0,0 +1,275 @@
+import contextvars
+import hashlib
+import os
+import re
+import time
+import traceback
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import NamedTuple
+
+import redis
+import structlog
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.backends.signals import connection_created
+from django_redis import get_redis_connection
+
+logger = structlog.get_logger(__name__)
+
+# Queries slower than this many milliseconds are logged and aggregated.
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "200"))
+# Also log the PostgreSQL plan of slow SELECTs (planned only, not executed).
+SLOW_QUERY_EXPLAIN = os.environ.get("SLOW_QUERY_EXPLAIN", "0") == "1"
+# Redis hashes keyed by fingerprint ID, read by config.views.SlowQueryStatsView.
+SLOW_QUERY_KEYS = {
+    "sql": "slow_queries:sql",
+    "count": "slow_queries:count",
+    "total_ms": "slow_queries:total_ms",
+    "source": "slow_queries:source",
+}
+
+_STRING_LITERALS = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERALS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r"\((?:\s*%s\s*,)+\s*%s\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+# Transaction bookkeeping repeats by design and is not an N+1.
+_TRANSACTION_STATEMENTS = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+# Frames below these are Django or library internals, not call sites.
+_PROJECT_DIR = str(Path(settings.BASE_DIR))
+_IGNORED_DIRS = ("site-packages", "/.venv/", str(Path(__file__).parent / "queries.py"))
+
+
+def fingerprint_sql(sql: str) -> str:
+    """SQL with literals and IN-list lengths removed, so one query shape."""
+    sql = _STRING_LITERALS.sub("?", sql)
+    sql = _NUMBER_LITERALS.sub("?", sql)
+    sql = _PLACEHOLDER_LISTS.sub("(%s, ...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def fingerprint_id(fingerprint: str) -> str:
+    return hashlib.sha1(fingerprint.encode(), usedforsecurity=False).hexdigest()[:12]
+
+
+def project_call_site(limit: int = 6) -> list[str]:
+    """The innermost project frames of the current stack, outermost first."""
+    frames = [
+        frame
+        for frame in traceback.extract_stack()[:-1]
+        if frame.filename.startswith(_PROJECT_DIR)
+        and not any(ignored in frame.filename for ignored in _IGNORED_DIRS)
+    ]
+    return [
+        f"{Path(frame.filename).relative_to(_PROJECT_DIR)}:{frame.lineno} in {frame.name}"
+        for frame in frames[-limit:]
+    ]
+
+
+class RecordedQuery(NamedTuple):
+    fingerprint: str
+    call_site: list[str]
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.queries: list[RecordedQuery] = []
+
+    def repeated(self, limit: int = 1) -> dict[str, list[RecordedQuery]]:
+        """Query shapes run more than limit times, with each execution."""
+        counts = Counter(query.fingerprint for query in self.queries)
+        repeated = defaultdict(list)
+        for query in self.queries:
+            if counts[query.fingerprint] > limit and not query.fingerprint.startswith(
+                _TRANSACTION_STATEMENTS
+            ):
+                repeated[query.fingerprint].append(query)
+        return dict(repeated)
+
+
+# Recorder for the code being measured. Like config.timing.request_timings it
+# follows the request into sync_to_async threads.
+query_recorder: contextvars.ContextVar[QueryRecorder | None] = contextvars.ContextVar(
+    "query_recorder", default=None
+)
+
+
+def _record_query(execute, sql, params, many, context):
+    recorder = query_recorder.get()
+    if recorder is not None:
+        recorder.queries.append(
+            RecordedQuery(fingerprint_sql(sql), project_call_site())
+        )
+    return execute(sql, params, many, context)
+
+
+# The request or taskiq task name the current queries run for, set by
+# config.middlewares.server_timing_middleware and the taskiq middleware.
+query_source: contextvars.ContextVar[object | None] = contextvars.ContextVar(
+    "query_source", default=None
+)
+
+
+def get_query_source() -> str | None:
+    source = query_source.get()
+    if source is None or isinstance(source, str):
+        return source
+    match = getattr(source, "resolver_match", None)
+    return match.view_name if match is not None else source.path
+
+
+def explain_query(connection, sql, params) -> str | None:
+    if connection.vendor != "postgresql" or not sql.lstrip().upper().startswith(
+        "SELECT"
+    ):
+        return None
+    try:
+        # In a savepoint, so a failed EXPLAIN does not abort the transaction
+        # the request is running in.
+        with (
+            transaction.atomic(using=connection.alias, savepoint=True),
+            # The DB-API cursor, so the EXPLAIN skips the execute wrappers.
+            connection.connection.cursor() as cursor,
+        ):
+            cursor.execute(f"EXPLAIN {sql}", params)
+            return "\n".join(row[0] for row in cursor.fetchall())
+    except (DatabaseError, connection.Database.Error):
+        logger.warning("Could not explain slow query", exc_info=True)
+        return None
+
+
+def aggregate_slow_query(fingerprint: str, duration_ms: float, source) -> None:
+    query_id = fingerprint_id(fingerprint)
+    try:
+        with get_redis_connection("default").pipeline(transaction=False) as pipe:
+            pipe.hset(SLOW_QUERY_KEYS["sql"], query_id, fingerprint)
+            pipe.hincrby(SLOW_QUERY_KEYS["count"], query_id, 1)
+            pipe.hincrbyfloat(SLOW_QUERY_KEYS["total_ms"], query_id, duration_ms)
+            if source is not None:
+                pipe.hset(SLOW_QUERY_KEYS["source"], query_id, source)
+            pipe.execute()
+    except redis.RedisError:
+        logger.warning("Could not aggregate slow query", exc_info=True)
+
+
+def _log_slow_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration_ms = (time.perf_counter() - started) * 1000
+    if duration_ms >= SLOW_QUERY_MS:
+        fingerprint = fingerprint_sql(sql)
+        source = get_query_source()
+        fields = {}
+        if SLOW_QUERY_EXPLAIN and not many:
+            fields["plan"] = explain_query(context["connection"], sql, params)
+        logger.warning(
+            "Slow query",
+            fingerprint=fingerprint,
+            fingerprint_id=fingerprint_id(fingerprint),
+            duration_ms=round(duration_ms, 1),
+            source=source,
+            database=context["connection"].alias,
+            **fields,
+        )
+        aggregate_slow_query(fingerprint, duration_ms, source)
+    return result
+
+
+def get_slow_query_stats() -> list[dict]:
+    """Aggregated slow queries, slowest in total first."""
+    with get_redis_connection("default").pipeline(transaction=False) as pipe:
+        for key in SLOW_QUERY_KEYS.values():
+            pipe.hgetall(key)
+        sql, counts, totals, sources = pipe.execute()
+    stats = []
+    for query_id, fingerprint in sql.items():
+        count = int(counts.get(query_id, 0))
+        total_ms = float(totals.get(query_id, 0))
+        stats.append(
+            {
+                "fingerprint_id": query_id.decode(),
+                "fingerprint": fingerprint.decode(),
+                "source": sources[query_id].decode() if query_id in sources else None,
+                "count": count,
+                "total_ms": round(total_ms, 1),
+                "mean_ms": round(total_ms / count, 1) if count else 0.0,
+            }
+        )
+    return sorted(stats, key=lambda stat: stat["total_ms"], reverse=True)
+
+
+def clear_slow_query_stats() -> None:
+    get_redis_connection("default").delete(*SLOW_QUERY_KEYS.values())
+
+
+def _install_query_wrappers(sender, connection, **kwargs):
+    for wrapper in (_record_query, _log_slow_query):
+        if wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(wrapper)
+
+
+connection_created.connect(_install_query_wrappers, dispatch_uid="config.queries")
+
+
+@contextmanager
+def record_queries():
+    # Connections opened before this module was imported missed the signal.
+    for connection in connections.all(initialized_only=True):
+        _install_query_wrappers(sender=None, connection=connection)
+    recorder = QueryRecorder()
+    token = query_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        query_recorder.reset(token)
+
+
+class QueryBudgetExceededError(AssertionError):
+    pass
+
+
+def query_budget_problems(
+    recorder: QueryRecorder, *, max_queries: int | None, repeat_limit: int = 1
+) -> list[str]:
+    problems = []
+    if max_queries is not None and len(recorder.queries) > max_queries:
+        problems.append(f"{len(recorder.queries)} queries, budget is {max_queries}")
+    for fingerprint, queries in recorder.repeated(repeat_limit).items():
+        call_sites = "\n".join(
+            "    " + "\n    ".join(query.call_site or ["<no project frames>"]) + "\n"
+            for query in queries
+        )
+        problems.append(f"{len(queries)}x {fingerprint}\n{call_sites}")
+    return problems
+
+
+@contextmanager
+def assert_query_budget(max_queries: int | None = None, *, repeat_limit: int = 1):
+    """
+    Fail if the block runs more than max_queries queries or any query shape
+    more than repeat_limit times, listing the call site of each repeat.
+    """
+    with record_queries() as recorder:
+        yield recorder
+    problems = query_budget_problems(
+        recorder, max_queries=max_queries, repeat_limit=repeat_limit
+    )
+    if problems:
+        raise QueryBudgetExceededError("\n".join(problems))
+
+
+def get_view_query_budget(request) -> tuple[str, int] | None:
+    """
+    The query_budget declared on the DRF view that handled the request, as
+    (view name, budget). Viewsets may declare a dict keyed by action.
+    """
+    match = getattr(request, "resolver_match", None)
+    view_class = getattr(getattr(match, "func", None), "cls", None)
+    budget = getattr(view_class, "query_budget", None)
+    if isinstance(budget, dict):
+        actions = getattr(match.func, "actions", None) or {}
+        budget = budget.get(actions.get(request.method.lower()))
+    if budget is None:
+        return None
+    return view_class.__name__, budget
@@ -0,0 +1,141 @@
+import contextvars
+import os
+import random
+import time
+from typing import Self
+
+import structlog
+from django.conf import settings
+from django.core.exceptions import SynchronousOnlyOperation
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = structlog.get_logger(__name__)
+
+# Replicas further behind the primary than this many seconds are skipped.
+REPLICA_MAX_LAG = float(os.environ.get("DATABASE_REPLICA_MAX_LAG", "5"))
+# How long a measured replica lag is trusted before it is measured again.
+REPLICA_LAG_CHECK_INTERVAL = float(
+    os.environ.get("DATABASE_REPLICA_LAG_CHECK_INTERVAL", "5")
+)
+# After a write, the client's following requests read from the primary for
+# this long, so they see their own writes. Keep it above REPLICA_MAX_LAG.
+PRIMARY_PIN_SECONDS = int(os.environ.get("DATABASE_PRIMARY_PIN_SECONDS", "10"))
+PRIMARY_PIN_COOKIE = "primary_pin"
+# Only these requests read from replicas. Other methods usually read what they
+# are about to write back (e.g. a balance), so they read the primary.
+REPLICA_READ_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+# Read on every request and expected to reflect the previous one.
+PRIMARY_ONLY_MODELS = frozenset({"sessions.session"})
+
+# Zero when the replica has replayed everything it received, so an idle
+# primary does not make the replica look behind.
+POSTGRESQL_REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(
+            EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0
+        )
+    END
+"""
+
+
+class ReplicaReads:
+    """Whether the current request may read from replicas."""
+
+    def __init__(self, *, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+    @classmethod
+    def for_request(cls, request) -> Self:
+        return cls(
+            pinned=request.method not in REPLICA_READ_METHODS
+            or PRIMARY_PIN_COOKIE in request.COOKIES
+        )
+
+
+# Set by config.middlewares.replica_routing_middleware. Reads made outside a
+# request (tasks, commands, lean routes) have none and stay on the primary.
+replica_reads: contextvars.ContextVar[ReplicaReads | None] = contextvars.ContextVar(
+    "replica_reads", default=None
+)
+
+# Last measured lag per replica alias: (measured at, lag in seconds or None
+# if the replica could not be reached).
+_replica_lag: dict[str, tuple[float, float | None]] = {}
+
+
+def measure_replica_lag(alias: str) -> float | None:
+    connection = connections[alias]
+    if connection.vendor != "postgresql":
+        return 0.0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(POSTGRESQL_REPLICA_LAG_SQL)
+            return float(cursor.fetchone()[0])
+    except DatabaseError:
+        logger.warning("Could not measure replica lag", database=alias, exc_info=True)
+        return None
+
+
+def get_replica_lag(alias: str) -> float | None:
+    measured_at, lag = _replica_lag.get(alias, (None, None))
+    now = time.monotonic()
+    if measured_at is None or now - measured_at >= REPLICA_LAG_CHECK_INTERVAL:
+        try:
+            lag = measure_replica_lag(alias)
+        except SynchronousOnlyOperation:
+            # Called from async code, which cannot query here. Read the primary
+            # this once and leave the measurement to the next sync caller.
+            return None
+        _replica_lag[alias] = (now, lag)
+        if lag is not None and lag > REPLICA_MAX_LAG:
+            logger.warning("Replica lagging", database=alias, lag=lag)
+    return lag
+
+
+def clear_replica_lag() -> None:
+    _replica_lag.clear()
+
+
+class ReplicaRouter:
+    """
+    Send reads of GET, HEAD and OPTIONS requests to a replica within lag while
+    the request has not written anything. Other methods, writes, atomic blocks
+    and pinned clients use the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        reads = replica_reads.get()
+        if (
+            reads is None
+            or reads.pinned
+            or reads.wrote
+            or model._meta.label_lower in PRIMARY_ONLY_MODELS  # noqa: SLF001
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        fresh = [
+            alias
+            for alias in settings.DATABASE_REPLICAS
+            if (lag := get_replica_lag(alias)) is not None and lag <= REPLICA_MAX_LAG
+        ]
+        return random.choice(fresh) if fresh else DEFAULT_DB_ALIAS  # noqa: S311
+
+    def db_for_write(self, model, **hints):
+        reads = replica_reads.get()
+        label = model._meta.label_lower  # noqa: SLF001
+        if reads is not None and label not in PRIMARY_ONLY_MODELS:
+            reads.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if {obj1._state.db, obj2._state.db} <= databases:  # noqa: SLF001
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
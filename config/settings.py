@@ -66,23 +66,49 @@ if DEBUG:
     staticfiles_index = INSTALLED_APPS.index("django.contrib.staticfiles")
     INSTALLED_APPS.insert(staticfiles_index, "whitenoise.runserver_nostatic")
 
+# Django's own middleware is replaced by the config.middlewares subclasses,
+# which run on the event loop for async requests instead of in a thread.
 MIDDLEWARE = [
-    "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
+    "config.middlewares.server_timing_middleware",
+    "config.middlewares.replica_routing_middleware",
+    "config.middlewares.SecurityMiddleware",
+    "config.middlewares.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
-    "django.middleware.common.CommonMiddleware",
-    "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
-    "django.contrib.messages.middleware.MessageMiddleware",
-    "config.middlewares.admin_name_middleware",
-    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "config.middlewares.CommonMiddleware",
+    "config.middlewares.site_snapshot_middleware",
+    "config.middlewares.CsrfViewMiddleware",
+    "config.middlewares.AuthenticationMiddleware",
+    "config.middlewares.MessageMiddleware",
+    "config.middlewares.XFrameOptionsMiddleware",
     "allauth.account.middleware.AccountMiddleware",
+    "config.middlewares.query_budget_middleware",
+    "config.middlewares.view_timing_middleware",
+]
+
+# Chain for stateless routes such as payment webhooks (see config.handlers).
+# They skip sessions, CSRF, auth, messages and allauth.
+LEAN_MIDDLEWARE = [
+    "config.middlewares.server_timing_middleware",
+    "config.middlewares.SecurityMiddleware",
+    "config.middlewares.CommonMiddleware",
+    "config.middlewares.query_budget_middleware",
+    "config.middlewares.view_timing_middleware",
+]
+# Stateless endpoints that never use sessions, messages, CSRF or allauth, so
+# they are served by LEAN_MIDDLEWARE. Add JWT-only API prefixes here once no
+# browser session client calls them.
+LEAN_ROUTE_PREFIXES = [
+    prefix
+    for prefix in os.environ.get(
+        "LEAN_ROUTE_PREFIXES", "/api/stripe-webhook/,/api/apple-webhook/"
+    ).split(",")
+    if prefix
 ]
 
 # Add debug-only middleware
 if DEBUG:
-    MIDDLEWARE.insert(1, "whitenoise.middleware.WhiteNoiseMiddleware")
-    MIDDLEWARE.append("config.middlewares.AllowIframeMiddleware")
+    MIDDLEWARE.insert(3, "whitenoise.middleware.WhiteNoiseMiddleware")
+    MIDDLEWARE.insert(-2, "config.middlewares.allow_iframe_middleware")
 
 # CORS settings
 CORS_ALLOW_METHODS = [
@@ -120,7 +146,51 @@ WSGI_APPLICATION = "config.wsgi.application"
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
 DATABASES = {"default": dj_database_url.config()}
-DATABASES["default"]["CONN_MAX_AGE"] = 60 if DEBUG else 0
+# Read-only replicas of the primary, e.g.
+# DATABASE_REPLICA_URLS=postgres://replica-1/web,postgres://replica-2/web or,
+# locally, a copy of the SQLite file. Reads are routed by
+# config.routers.ReplicaRouter.
+DATABASE_REPLICAS = []
+for index, url in enumerate(
+    url for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url
+):
+    DATABASE_REPLICAS.append(f"replica_{index}")
+    # Tests use the primary's test database for the replicas.
+    DATABASES[f"replica_{index}"] = {
+        **dj_database_url.parse(url),
+        "TEST": {"MIRROR": "default"},
+    }
+if DATABASE_REPLICAS:
+    DATABASE_ROUTERS = ["config.routers.ReplicaRouter"]
+
+for database in DATABASES.values():
+    database["CONN_MAX_AGE"] = 60 if DEBUG else 0
+    if database.get("ENGINE") != "django.db.backends.postgresql":
+        continue
+    # Same backend, plus connection wait time in the request timings.
+    database["ENGINE"] = "config.postgresql"
+    if not DEBUG and os.environ.get("DATABASE_POOL", "1") == "1":
+        # psycopg's pool instead of a connection per request. Connections are
+        # checked out by the thread running the ORM call (under ASGI, the
+        # request's sync_to_async thread) and returned when Django closes them
+        # at the end of the request, which is why CONN_MAX_AGE stays 0.
+        # Also makes Django pass ConnectionPool.check_connection as the pool's
+        # check, so broken connections are discarded on checkout.
+        database["CONN_HEALTH_CHECKS"] = True
+        database.setdefault("OPTIONS", {})["pool"] = {
+            "min_size": int(os.environ.get("DATABASE_POOL_MIN_SIZE", "2")),
+            "max_size": int(os.environ.get("DATABASE_POOL_MAX_SIZE", "10")),
+            # Seconds; connections are replaced after this so server-side
+            # memory and failovers are picked up.
+            "max_lifetime": float(os.environ.get("DATABASE_POOL_MAX_LIFETIME", "1800")),
+            "max_idle": float(os.environ.get("DATABASE_POOL_MAX_IDLE", "300")),
+            # Seconds a request waits for a free connection before failing.
+            "timeout": float(os.environ.get("DATABASE_POOL_TIMEOUT", "10")),
+        }
+
+# How config.middlewares.query_budget_middleware treats DRF views that exceed
+# their declared query_budget: "off", "log" or "raise". Tests use "raise".
+QUERY_BUDGET_MODE = os.environ.get("QUERY_BUDGET_MODE", "off")
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -218,6 +288,7 @@ LOGGING_BASE_APPS = [
     "config",
     "contact",
     "payment",
+    "sites",
     "teams",
     "users",
 ]
@@ -320,7 +391,7 @@ CHANNEL_LAYERS = {
 
 CACHES = {
     "default": {
-        "BACKEND": "django_redis.cache.RedisCache",
+        "BACKEND": "config.timing.TimedRedisCache",
         "LOCATION": REDIS_URL,
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
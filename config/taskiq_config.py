@@ -2,7 +2,7 @@ import asyncio
 import os
 
 import structlog
-from taskiq import TaskiqScheduler
+from taskiq import TaskiqMiddleware, TaskiqScheduler
 from taskiq.schedule_sources import LabelScheduleSource
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
@@ -14,11 +14,25 @@ if not settings.configured:
 
 from taskiq_redis import ListQueueBroker
 
+from config.queries import query_source
+
 logger = structlog.get_logger(__name__)
 
+
+class QuerySourceMiddleware(TaskiqMiddleware):
+    """Name the running task as the source of its slow queries."""
+
+    def pre_execute(self, message):
+        query_source.set(message.task_name)
+        return message
+
+    def post_execute(self, message, result):
+        query_source.set(None)
+
+
 broker = ListQueueBroker(
     url=settings.BROKER_URL,
-)
+).with_middlewares(QuerySourceMiddleware())
 
 scheduler = TaskiqScheduler(
     broker=broker,
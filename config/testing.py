@@ -0,0 +1,36 @@
+"""Helpers shared by the test modules."""
+
+import asyncio
+
+
+async def call_asgi(app, method, path, headers=()):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"testserver"), *headers],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    messages = []
+    bodies = [{"type": "http.request", "body": b"{}", "more_body": False}]
+
+    async def receive():
+        if bodies:
+            return bodies.pop()
+        # No disconnect until the response is sent; Django cancels this wait.
+        await asyncio.Event().wait()
+        return None
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    start = messages[0]
+    return start["status"], {name.lower(): value for name, value in start["headers"]}
@@ -0,0 +1,620 @@
+import logging
+import time
+
+import pytest
+import structlog
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import SynchronousOnlyOperation
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import AsyncClient, override_settings
+from django.urls import path
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from config import db as config_db
+from config import middlewares, routers
+from config import queries as config_queries
+from config import timing as config_timing
+from config import views as config_views
+from config.handlers import LeanASGIHandler, route_by_middleware_profile
+from config.memory_cache import MemoryCache
+from config.postgresql import base as postgresql_base
+from config.routers import ReplicaRouter
+from config.taskiq_config import QuerySourceMiddleware
+from config.testing import call_asgi
+from sites import utils as site_utils
+
+
+class TimedLocMemCache(config_timing.TimedCacheMixin, LocMemCache):
+    pass
+
+
+def timed_view(request):
+    Site.objects.count()
+    cache.get("timed-view")
+    return HttpResponse("ok")
+
+
+async def async_timed_view(request):
+    await Site.objects.acount()
+    return HttpResponse("ok")
+
+
+# WhiteNoise is sync-only and only installed with DEBUG; without it the whole
+# chain runs in async mode.
+ASYNC_MIDDLEWARE = [
+    middleware for middleware in settings.MIDDLEWARE if "whitenoise" not in middleware
+]
+
+
+async def async_ok_view(request):
+    return HttpResponse("ok")
+
+
+async def async_user_view(request):
+    user = await request.auser()
+    return HttpResponse(user.email)
+
+
+async def async_session_view(request):
+    await request.session.aset("seen", value=True)
+    return HttpResponse("ok")
+
+
+class SiteNamesView(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    query_budget = 2
+
+    def get(self, request):
+        site_ids = Site.objects.values_list("pk", flat=True)
+        # One query per site: the N+1 the budget should catch.
+        return Response([Site.objects.get(pk=site_id).name for site_id in site_ids])
+
+
+urlpatterns = [
+    path("site-names/", SiteNamesView.as_view()),
+    path("timed/", timed_view),
+    path("async-session/", async_session_view),
+    path("async-timed/", async_timed_view),
+    path("async-ok/", async_ok_view),
+    path("async-user/", async_user_view),
+]
+
+
+def test_memory_cache_evicts_least_recently_used_entries():
+    memory_cache = MemoryCache(max_size=2, ttl=60)
+    memory_cache.set("a", 1)
+    memory_cache.set("b", 2)
+    memory_cache.get("a")
+    memory_cache.set("c", 3)
+
+    assert memory_cache.get("a") == 1
+    assert memory_cache.get("b") is None
+    assert memory_cache.get("c") == 3
+    assert memory_cache.stats().size == 2
+
+
+def test_memory_cache_expires_entries_and_counts_hits_and_misses():
+    memory_cache = MemoryCache(max_size=10, ttl=60)
+    memory_cache.set("fresh", "value")
+    memory_cache.set("expired", "value", ttl=0)
+
+    assert memory_cache.get("fresh") == "value"
+    assert memory_cache.get("expired") is None
+    assert memory_cache.stats().hits == 1
+    assert memory_cache.stats().misses == 1
+    assert memory_cache.stats().size == 1
+
+
+@pytest.fixture
+def timed_queries():
+    config_timing._install_query_timer(sender=None, connection=connection)
+    yield
+    connection.execute_wrappers.remove(config_timing._time_query)
+
+
+@pytest.mark.django_db
+@override_settings(
+    ROOT_URLCONF="config.tests",
+    CACHES={"default": {"BACKEND": "config.tests.TimedLocMemCache"}},
+)
+def test_server_timing_header_reports_phases_for_token_holders(
+    client, monkeypatch, timed_queries
+):
+    monkeypatch.setattr(middlewares, "SERVER_TIMING_TOKEN", "timing-secret")
+
+    response = client.get("/timed/", HTTP_X_SERVER_TIMING_TOKEN="timing-secret")
+
+    server_timing = response.headers["Server-Timing"]
+    assert server_timing.startswith("total;dur=")
+    for metric in ["middleware;dur=", "view;dur=", "db;dur=", "cache;dur="]:
+        assert metric in server_timing
+    assert 'desc="1 calls"' in server_timing
+    log_context = structlog.contextvars.get_contextvars()
+    structlog.contextvars.clear_contextvars()
+    assert log_context["db_count"] >= 1
+    assert log_context["cache_count"] == 1
+    assert log_context["total_ms"] >= log_context["view_ms"]
+
+    response = client.get("/timed/", HTTP_X_SERVER_TIMING_TOKEN="wrong")
+
+    assert "Server-Timing" not in response.headers
+
+
+class FakeConnectionPool:
+    def get_stats(self):
+        return {
+            "pool_min": 2,
+            "pool_max": 10,
+            "pool_size": 4,
+            "pool_available": 1,
+            "requests_waiting": 0,
+            "requests_num": 8,
+            "requests_wait_ms": 20,
+        }
+
+
+@pytest.mark.django_db
+@override_settings(
+    ROOT_URLCONF="config.tests",
+    CACHES={"default": {"BACKEND": "config.tests.TimedLocMemCache"}},
+)
+def test_request_log_reports_database_pool_utilization(client, monkeypatch):
+    assert config_db.get_database_pool_stats() is None
+
+    pool = FakeConnectionPool()
+    monkeypatch.setattr(config_db, "get_database_pool", lambda alias=None: pool)
+    with structlog.testing.capture_logs() as logs:
+        client.get("/timed/")
+    structlog.contextvars.clear_contextvars()
+
+    stats = config_db.get_database_pool_stats()
+    assert stats.utilization == 0.3
+    assert stats.average_wait_ms == 2.5
+    finished = next(log for log in logs if log["event"] == "Request finished")
+    assert finished["db_pool_size"] == 4
+    assert finished["db_pool_utilization"] == 0.3
+
+
+def test_postgresql_backend_times_connection_checkout(monkeypatch):
+    monkeypatch.setattr(
+        postgresql_base.base.DatabaseWrapper,
+        "get_new_connection",
+        lambda self, conn_params: time.sleep(0.01) or "connection",
+    )
+    wrapper = postgresql_base.DatabaseWrapper.__new__(postgresql_base.DatabaseWrapper)
+    timings = config_timing.RequestTimings()
+    token = config_timing.request_timings.set(timings)
+    try:
+        assert wrapper.get_new_connection({}) == "connection"
+    finally:
+        config_timing.request_timings.reset(token)
+
+    assert timings.counts["db_connect"] == 1
+    assert timings.durations["db_connect"] >= 0.01
+
+
+@pytest.mark.django_db
+@override_settings(ROOT_URLCONF="config.tests")
+def test_server_timing_middleware_times_async_requests(monkeypatch):
+    monkeypatch.setattr(middlewares, "SERVER_TIMING_TOKEN", "timing-secret")
+
+    response = async_to_sync(AsyncClient().get)(
+        "/async-timed/", headers={"X-Server-Timing-Token": "timing-secret"}
+    )
+
+    assert "view;dur=" in response.headers["Server-Timing"]
+
+
+@pytest.mark.django_db
+@override_settings(ROOT_URLCONF="config.tests", MIDDLEWARE=ASYNC_MIDDLEWARE)
+def test_server_timing_middleware_does_not_load_the_user_for_staff_check():
+    staff = get_user_model().objects.create_user(email="staff@example.com", is_staff=True)
+    client = AsyncClient()
+    async_to_sync(client.aforce_login)(staff)
+
+    with config_queries.record_queries() as recorder:
+        response = async_to_sync(client.get)("/async-ok/")
+
+    assert "Server-Timing" not in response.headers
+    assert not [
+        query
+        for query in recorder.queries
+        if "django_session" in query.fingerprint or "users_user" in query.fingerprint
+    ]
+    # Views that load the user anyway still show the header to staff.
+    response = async_to_sync(client.get)("/async-user/")
+    assert "view;dur=" in response.headers["Server-Timing"]
+
+
+@pytest.mark.django_db
+def test_lean_routes_skip_session_and_clickjacking_middleware():
+    app = route_by_middleware_profile(ASGIHandler(), LeanASGIHandler())
+
+    webhook_status, webhook_headers = async_to_sync(call_asgi)(
+        app, "POST", "/api/apple-webhook/"
+    )
+    csrf_status, csrf_headers = async_to_sync(call_asgi)(app, "GET", "/api/csrf/")
+
+    assert webhook_status == 400
+    assert b"x-frame-options" not in webhook_headers
+    assert csrf_status == 200
+    assert csrf_headers[b"x-frame-options"] == b"DENY"
+
+
+middleware_settings_seen = []
+
+
+def record_middleware_setting(get_response):
+    middleware_settings_seen.append(settings.MIDDLEWARE)
+    return get_response
+
+
+@pytest.mark.django_db
+@override_settings(
+    ROOT_URLCONF="config.tests",
+    LEAN_MIDDLEWARE=["config.tests.record_middleware_setting"],
+    LEAN_ROUTE_PREFIXES=["/async-ok/"],
+)
+def test_lean_handler_builds_its_chain_without_swapping_settings():
+    middleware_settings_seen.clear()
+    app = route_by_middleware_profile(ASGIHandler(), LeanASGIHandler())
+
+    status, _headers = async_to_sync(call_asgi)(app, "GET", "/async-ok/")
+
+    assert status == 200
+    assert middleware_settings_seen == [settings.MIDDLEWARE]
+
+
+@pytest.mark.exploratory
+@pytest.mark.django_db
+def test_benchmark_webhook_requests_per_second_by_middleware_profile():
+    number = 500
+    # Keep the per-request log lines out of the measurement.
+    logging.disable(logging.CRITICAL)
+
+    for name, app in [("full MIDDLEWARE", ASGIHandler()), ("LEAN_MIDDLEWARE", LeanASGIHandler())]:
+
+        async def post_webhooks(app=app):
+            for _ in range(number):
+                await call_asgi(app, "POST", "/api/apple-webhook/")
+
+        async_to_sync(call_asgi)(app, "POST", "/api/apple-webhook/")
+        started = time.perf_counter()
+        async_to_sync(post_webhooks)()
+        elapsed = time.perf_counter() - started
+        print(f"{name:16} {number / elapsed:.0f} requests/s")
+    logging.disable(logging.NOTSET)
+
+
+@pytest.fixture
+def counted_thread_hops(thread_hops, monkeypatch):
+    """Report thread hops in Server-Timing for the timing-secret token."""
+    monkeypatch.setattr(middlewares, "SERVER_TIMING_TOKEN", "timing-secret")
+    # Loaded up front, so a cold site snapshot is not counted as a hop.
+    site_utils.get_site_snapshot()
+    return [(b"x-server-timing-token", b"timing-secret")]
+
+
+@pytest.mark.django_db
+def test_project_middleware_adds_no_thread_hops_to_async_views(counted_thread_hops):
+    bare_middleware = [
+        "config.middlewares.server_timing_middleware",
+        "config.middlewares.view_timing_middleware",
+    ]
+
+    server_timings = []
+    for middleware in [bare_middleware, ASYNC_MIDDLEWARE]:
+        with override_settings(ROOT_URLCONF="config.tests", MIDDLEWARE=middleware):
+            app = ASGIHandler()
+            status, headers = async_to_sync(call_asgi)(
+                app,
+                "GET",
+                "/async-ok/",
+                headers=counted_thread_hops,
+            )
+        assert status == 200
+        server_timings.append(headers[b"server-timing"].split(b"hops;")[1])
+
+    assert server_timings[0] == server_timings[1]
+
+
+@pytest.mark.django_db
+@override_settings(ROOT_URLCONF="config.tests", MIDDLEWARE=ASYNC_MIDDLEWARE)
+def test_event_loop_csrf_middleware_checks_unsafe_requests_in_a_thread(
+    counted_thread_hops,
+):
+    status, headers = async_to_sync(call_asgi)(
+        ASGIHandler(), "POST", "/async-ok/", headers=counted_thread_hops
+    )
+
+    # Rejected for lacking a CSRF cookie. Reading the form and rendering the
+    # failure view ran in a thread, not on the event loop.
+    assert status == 403
+    assert b'hops;desc="1 sync_to_async' in headers[b"server-timing"]
+
+
+@pytest.mark.django_db
+@override_settings(ROOT_URLCONF="config.tests", MIDDLEWARE=ASYNC_MIDDLEWARE)
+def test_event_loop_session_middleware_saves_modified_sessions_in_a_thread():
+    app = ASGIHandler()
+
+    status, headers = async_to_sync(call_asgi)(app, "GET", "/async-session/")
+
+    assert status == 200
+    assert headers[b"set-cookie"].startswith(b"sessionid=")
+
+
+async def run_lifespan(app, *message_types):
+    received = [{"type": message_type} for message_type in message_types]
+    sent = []
+
+    async def receive():
+        return received.pop(0)
+
+    async def send(message):
+        sent.append(message["type"])
+
+    await app({"type": "lifespan"}, receive, send)
+    return sent
+
+
+@pytest.fixture
+def lifespan_calls(monkeypatch):
+    from config import asgi  # noqa: PLC0415
+
+    calls = []
+    for name in [
+        "open_http_client",
+        "open_database_pool",
+        "start_site_invalidation_listener",
+        "stop_site_invalidation_listener",
+        "close_http_client",
+        "close_database_pool",
+    ]:
+
+        async def record(name=name):
+            calls.append(name)
+
+        monkeypatch.setattr(asgi, name, record)
+    return asgi, calls
+
+
+async def unreachable(*args, **kwargs):
+    raise ConnectionError
+
+
+def test_lifespan_starts_up_when_the_site_snapshot_cannot_be_warmed(
+    lifespan_calls, monkeypatch
+):
+    asgi, calls = lifespan_calls
+    monkeypatch.setattr(asgi, "aget_site_snapshot", unreachable)
+
+    sent = async_to_sync(run_lifespan)(
+        asgi.lifespan_app, "lifespan.startup", "lifespan.shutdown"
+    )
+
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert "start_site_invalidation_listener" in calls
+    assert "close_database_pool" in calls
+
+
+def test_lifespan_reports_failed_startup(lifespan_calls, monkeypatch):
+    asgi, calls = lifespan_calls
+    monkeypatch.setattr(asgi, "open_database_pool", unreachable)
+
+    sent = async_to_sync(run_lifespan)(asgi.lifespan_app, "lifespan.startup")
+
+    assert sent == ["lifespan.startup.failed"]
+    assert "start_site_invalidation_listener" not in calls
+
+
+@pytest.fixture
+def replicas(monkeypatch, settings):
+    settings.DATABASE_REPLICAS = ["replica_0"]
+    lags = {"replica_0": 0.0}
+    monkeypatch.setattr(routers, "measure_replica_lag", lags.get)
+    routers.clear_replica_lag()
+    yield lags
+    routers.clear_replica_lag()
+
+
+def routed_view(request):
+    router = ReplicaRouter()
+    if request.method == "POST":
+        router.db_for_write(Site)
+    return HttpResponse(router.db_for_read(Site))
+
+
+def test_replica_routing_pins_the_client_to_the_primary_after_a_write(rf, replicas):
+    handler = middlewares.replica_routing_middleware(routed_view)
+
+    assert handler(rf.get("/")).content == b"replica_0"
+    response = handler(rf.post("/"))
+    assert response.content == b"default"
+    assert response.cookies[routers.PRIMARY_PIN_COOKIE]["max-age"] == (
+        routers.PRIMARY_PIN_SECONDS
+    )
+
+    request = rf.get("/")
+    request.COOKIES[routers.PRIMARY_PIN_COOKIE] = "1"
+    response = handler(request)
+    assert response.content == b"default"
+    assert routers.PRIMARY_PIN_COOKIE not in response.cookies
+
+
+def test_replica_routing_reads_the_primary_for_unsafe_methods(rf, replicas):
+    def read_view(request):
+        return HttpResponse(ReplicaRouter().db_for_read(Site))
+
+    handler = middlewares.replica_routing_middleware(read_view)
+
+    assert handler(rf.get("/")).content == b"replica_0"
+    # A POST reading a row it is about to update must not see replica lag.
+    response = handler(rf.post("/"))
+    assert response.content == b"default"
+    assert routers.PRIMARY_PIN_COOKIE not in response.cookies
+
+
+def test_replica_router_keeps_sessions_and_non_request_reads_on_the_primary(
+    rf, replicas
+):
+    router = ReplicaRouter()
+    assert router.db_for_read(Site) == "default"
+
+    def session_view(request):
+        router.db_for_write(Session)
+        return HttpResponse(f"{router.db_for_read(Session)} {router.db_for_read(Site)}")
+
+    response = middlewares.replica_routing_middleware(session_view)(rf.get("/"))
+
+    assert response.content == b"default replica_0"
+    assert routers.PRIMARY_PIN_COOKIE not in response.cookies
+
+
+def test_replica_router_falls_back_to_the_primary_when_replicas_lag(
+    rf, replicas, monkeypatch
+):
+    handler = middlewares.replica_routing_middleware(routed_view)
+    monkeypatch.setattr(routers, "REPLICA_LAG_CHECK_INTERVAL", 0)
+
+    replicas["replica_0"] = routers.REPLICA_MAX_LAG + 1
+    assert handler(rf.get("/")).content == b"default"
+    # Unreachable replicas report no lag.
+    replicas["replica_0"] = None
+    assert handler(rf.get("/")).content == b"default"
+    replicas["replica_0"] = 0.5
+    assert handler(rf.get("/")).content == b"replica_0"
+
+
+def test_replica_lag_is_not_cached_when_measuring_was_skipped(replicas, monkeypatch):
+    def measure_from_async_code(alias):
+        raise SynchronousOnlyOperation
+
+    monkeypatch.setattr(routers, "measure_replica_lag", measure_from_async_code)
+    assert routers.get_replica_lag("replica_0") is None
+
+    monkeypatch.setattr(routers, "measure_replica_lag", replicas.get)
+    assert routers.get_replica_lag("replica_0") == 0.0
+
+
+@pytest.mark.django_db
+def test_replica_router_reads_the_primary_inside_transactions(rf, replicas):
+    def atomic_view(request):
+        with transaction.atomic():
+            return HttpResponse(ReplicaRouter().db_for_read(Site))
+
+    # pytest-django wraps the test in a transaction already.
+    response = middlewares.replica_routing_middleware(atomic_view)(rf.get("/"))
+
+    assert response.content == b"default"
+
+
+def test_fingerprint_sql_ignores_literals_and_in_list_lengths():
+    assert config_queries.fingerprint_sql(
+        "SELECT *  FROM t WHERE id IN (%s, %s, %s) AND name = 'x' LIMIT 21"
+    ) == config_queries.fingerprint_sql(
+        "SELECT * FROM t WHERE id IN (%s, %s) AND name = 'y' LIMIT 1"
+    )
+
+
+@pytest.mark.django_db
+@override_settings(ROOT_URLCONF="config.tests")
+def test_query_budget_reports_the_call_site_of_each_repeated_query(client):
+    Site.objects.create(domain="one.test", name="One")
+
+    with pytest.raises(config_queries.QueryBudgetExceededError) as excinfo:
+        client.get("/site-names/")
+
+    message = str(excinfo.value)
+    assert message.startswith("SiteNamesView exceeded its query budget")
+    assert "3 queries, budget is 2" in message
+    assert "2x SELECT" in message
+    assert message.count("config/tests.py") == 2
+    assert " in get" in message
+
+
+@pytest.mark.django_db
+@override_settings(ROOT_URLCONF="config.tests", QUERY_BUDGET_MODE="log")
+def test_query_budget_only_logs_in_log_mode(client):
+    Site.objects.create(domain="one.test", name="One")
+
+    with structlog.testing.capture_logs() as logs:
+        response = client.get("/site-names/")
+
+    assert response.status_code == 200
+    warning = next(log for log in logs if log["event"] == "Query budget exceeded")
+    assert warning["view"] == "SiteNamesView"
+
+
+@pytest.mark.django_db
+def test_assert_query_budget_passes_within_budget():
+    with config_queries.assert_query_budget(1) as recorder:
+        Site.objects.count()
+
+    assert len(recorder.queries) == 1
+
+
+@pytest.mark.django_db
+@override_settings(
+    ROOT_URLCONF="config.tests",
+    CACHES={"default": {"BACKEND": "config.tests.TimedLocMemCache"}},
+)
+def test_slow_queries_are_logged_and_aggregated_with_their_view(client, monkeypatch):
+    aggregated = []
+    monkeypatch.setattr(config_queries, "SLOW_QUERY_MS", 0)
+    monkeypatch.setattr(
+        config_queries, "aggregate_slow_query", lambda *args: aggregated.append(args)
+    )
+    config_queries._install_query_wrappers(sender=None, connection=connection)
+
+    with structlog.testing.capture_logs() as logs:
+        client.get("/timed/")
+    structlog.contextvars.clear_contextvars()
+
+    slow = [log for log in logs if log["event"] == "Slow query"]
+    count_query = next(log for log in slow if "COUNT(*)" in log["fingerprint"])
+    assert count_query["source"] == "config.tests.timed_view"
+    assert count_query["fingerprint_id"] == config_queries.fingerprint_id(
+        count_query["fingerprint"]
+    )
+    assert "plan" not in count_query
+    assert (count_query["fingerprint"], "config.tests.timed_view") in [
+        (fingerprint, source) for fingerprint, _duration, source in aggregated
+    ]
+
+
+def test_taskiq_middleware_names_the_task_as_query_source():
+    middleware = QuerySourceMiddleware()
+    message = type("Message", (), {"task_name": "users.tasks:send_email"})()
+
+    middleware.pre_execute(message)
+    assert config_queries.get_query_source() == "users.tasks:send_email"
+    middleware.post_execute(message, result=None)
+    assert config_queries.get_query_source() is None
+
+
+@pytest.mark.django_db
+def test_slow_query_stats_are_staff_only(client, monkeypatch):
+    monkeypatch.setattr(config_views, "get_slow_query_stats", lambda: [{"count": 2}])
+    user = get_user_model().objects.create_user(email="staff@example.com")
+    client.force_login(user)
+
+    assert client.get("/api/slow-queries/").status_code == 403
+
+    user.is_staff = True
+    user.save()
+    response = client.get("/api/slow-queries/")
+
+    assert response.status_code == 200
+    assert response.json() == [{"count": 2}]
@@ -0,0 +1,186 @@
+import contextvars
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import AsyncToSync, SyncToAsync
+from django.db.backends.signals import connection_created
+from django_redis.cache import RedisCache
+
+# Phases reported in Server-Timing and the request log line, besides "total".
+PHASES = ("middleware", "view", "db", "db_connect", "cache", "http", "stripe", "email")
+# Sync/async adapter switches, counted when THREAD_HOP_COUNTER=1.
+THREAD_HOPS = ("sync_to_async", "async_to_sync")
+TIMING_LOG_KEYS = (
+    "total_ms",
+    *(f"{phase}_ms" for phase in PHASES),
+    *(f"{name}_count" for name in (*PHASES, *THREAD_HOPS)),
+)
+THREAD_HOP_COUNTER = os.environ.get("THREAD_HOP_COUNTER", "0") == "1"
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations: defaultdict[str, float] = defaultdict(float)
+        self.counts: defaultdict[str, int] = defaultdict(int)
+        if getattr(SyncToAsync.__call__, "counts_thread_hops", False):
+            for hop in THREAD_HOPS:
+                self.counts[hop] = 0
+
+    def record(self, phase: str, seconds: float) -> None:
+        self.durations[phase] += seconds
+        self.counts[phase] += 1
+
+    def finish(self) -> None:
+        total = time.perf_counter() - self.started
+        self.durations["total"] = total
+        self.durations["middleware"] = total - self.durations["view"]
+
+    def server_timing(self) -> str:
+        metrics = [f"total;dur={self.durations['total'] * 1000:.1f}"]
+        for phase in PHASES:
+            if phase not in self.durations:
+                continue
+            metric = f"{phase};dur={self.durations[phase] * 1000:.1f}"
+            if phase not in {"middleware", "view"}:
+                metric += f';desc="{self.counts[phase]} calls"'
+            metrics.append(metric)
+        if any(hop in self.counts for hop in THREAD_HOPS):
+            hops = ", ".join(f"{self.counts[hop]} {hop}" for hop in THREAD_HOPS)
+            metrics.append(f'hops;desc="{hops}"')
+        return ", ".join(metrics)
+
+    def log_fields(self) -> dict[str, float | int]:
+        fields = {}
+        for phase, seconds in self.durations.items():
+            fields[f"{phase}_ms"] = round(seconds * 1000, 1)
+        for phase in PHASES:
+            if phase not in {"middleware", "view"} and phase in self.durations:
+                fields[f"{phase}_count"] = self.counts[phase]
+        for hop in THREAD_HOPS:
+            if hop in self.counts:
+                fields[f"{hop}_count"] = self.counts[hop]
+        return fields
+
+
+# Timings for the request being handled. Context variables follow the request
+# into sync_to_async threads, so ORM and cache calls made there are recorded.
+request_timings: contextvars.ContextVar[RequestTimings | None] = (
+    contextvars.ContextVar("request_timings", default=None)
+)
+
+
+@contextmanager
+def timed_phase(phase: str):
+    """Add the duration of the block to the current request's timings."""
+    timings = request_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.record(phase, time.perf_counter() - started)
+
+
+def install_thread_hop_counter() -> None:
+    """
+    Count every sync_to_async and async_to_sync call in the request timings.
+    This wraps asgiref's adapters process-wide, so it is meant for debugging
+    and load tests rather than normal production traffic.
+    """
+    if getattr(SyncToAsync.__call__, "counts_thread_hops", False):
+        return
+    sync_to_async_call = SyncToAsync.__call__
+    async_to_sync_call = AsyncToSync.__call__
+
+    async def counting_sync_to_async_call(self, *args, **kwargs):
+        timings = request_timings.get()
+        if timings is not None:
+            timings.counts["sync_to_async"] += 1
+        return await sync_to_async_call(self, *args, **kwargs)
+
+    def counting_async_to_sync_call(self, *args, **kwargs):
+        timings = request_timings.get()
+        if timings is not None:
+            timings.counts["async_to_sync"] += 1
+        return async_to_sync_call(self, *args, **kwargs)
+
+    counting_sync_to_async_call.counts_thread_hops = True
+    SyncToAsync.__call__ = counting_sync_to_async_call
+    AsyncToSync.__call__ = counting_async_to_sync_call
+
+
+if THREAD_HOP_COUNTER:
+    install_thread_hop_counter()
+
+
+def _time_query(execute, sql, params, many, context):
+    with timed_phase("db"):
+        return execute(sql, params, many, context)
+
+
+def _install_query_timer(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+connection_created.connect(_install_query_timer, dispatch_uid="config.timing")
+
+
+class TimedCacheMixin:
+    """
+    Record cache calls in the request timings. The async methods of Django's
+    cache backends delegate to these, so they are covered too.
+    """
+
+    def get(self, *args, **kwargs):
+        with timed_phase("cache"):
+            return super().get(*args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        with timed_phase("cache"):
+            return super().set(*args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        with timed_phase("cache"):
+            return super().add(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with timed_phase("cache"):
+            return super().delete(*args, **kwargs)
+
+    def touch(self, *args, **kwargs):
+        with timed_phase("cache"):
+            return super().touch(*args, **kwargs)
+
+    def has_key(self, *args, **kwargs):
+        with timed_phase("cache"):
+            return super().has_key(*args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        with timed_phase("cache"):
+            return super().incr(*args, **kwargs)
+
+    def decr(self, *args, **kwargs):
+        with timed_phase("cache"):
+            return super().decr(*args, **kwargs)
+
+    def get_many(self, *args, **kwargs):
+        with timed_phase("cache"):
+            return super().get_many(*args, **kwargs)
+
+    def set_many(self, *args, **kwargs):
+        with timed_phase("cache"):
+            return super().set_many(*args, **kwargs)
+
+    def delete_many(self, *args, **kwargs):
+        with timed_phase("cache"):
+            return super().delete_many(*args, **kwargs)
+
+
+class TimedRedisCache(TimedCacheMixin, RedisCache):
+    pass
@@ -18,6 +18,7 @@ from oauth2_provider.urls import (
 from config.admin import site as dynamic_admin_site
 from config.installed_apps import get_installed_apps
 from config.jwt import jwks_view
+from config.views import SlowQueryStatsView
 from sites import views
 
 admin_suffix = f"-{settings.ADMIN_SUFFIX}" if not settings.DEBUG else ""
@@ -33,6 +34,7 @@ urlpatterns = [
     path(f"admin{admin_suffix}/", dynamic_admin_site.urls),
     path(".well-known/jwks.json", jwks_view, name="jwks"),
     path("api/csrf/", views.csrf_token, name="csrf-token"),
+    path("api/slow-queries/", SlowQueryStatsView.as_view(), name="slow-queries"),
     path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
     path(
         "o/",
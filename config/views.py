@@ -0,0 +1,24 @@
+from drf_spectacular.utils import extend_schema
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from config.queries import clear_slow_query_stats, get_slow_query_stats
+
+
+@extend_schema(exclude=True)
+class SlowQueryStatsView(APIView):
+    """
+    Slow queries aggregated by fingerprint across workers, slowest in total
+    first. DELETE starts a new measurement window.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_slow_query_stats())
+
+    def delete(self, request):
+        clear_slow_query_stats()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,63 @@
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from asgiref.sync import AsyncToSync, SyncToAsync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+
+from config.timing import RequestTimings, install_thread_hop_counter, request_timings
+from payment.models import Subscription
+from sites import frontend
+
+
+@pytest.fixture(autouse=True)
+def enforce_query_budgets(settings):
+    settings.QUERY_BUDGET_MODE = "raise"
+
+
+@pytest.fixture
+def locmem_cache(settings):
+    """The default cache in memory, for tests of code that caches in Redis."""
+    settings.CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    }
+    cache.clear()
+    frontend.local_index_cache.clear()
+    yield cache
+    cache.clear()
+    frontend.local_index_cache.clear()
+
+
+@pytest.fixture
+def subscriber():
+    """A user with a balance and an active subscription."""
+    user = get_user_model().objects.create_user(email="member@example.com")
+    account = user.get_account()
+    account.balance = Decimal("12.50")
+    account.save()
+    Subscription.objects.create(
+        account=account,
+        subscription_type="pro",
+        expiration_date=timezone.now() + timedelta(days=30),
+    )
+    return user
+
+
+@pytest.fixture
+def thread_hops(monkeypatch):
+    """
+    Count sync_to_async and async_to_sync calls made while the test runs, with
+    the counter behind THREAD_HOP_COUNTER. Requests count their own hops.
+    """
+    # monkeypatch restores asgiref's adapters after the test.
+    monkeypatch.setattr(SyncToAsync, "__call__", SyncToAsync.__call__)
+    monkeypatch.setattr(AsyncToSync, "__call__", AsyncToSync.__call__)
+    install_thread_hop_counter()
+    timings = RequestTimings()
+    token = request_timings.set(timings)
+    yield timings.counts
+    request_timings.reset(token)
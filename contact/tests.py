@@ -5,6 +5,7 @@ from django.test import override_settings
 
 from contact.models import ContactSubmission
 from sites.models import SiteAttributes
+from sites.utils import clear_site_snapshot
 
 pytestmark = pytest.mark.django_db
 
@@ -21,6 +22,7 @@ def contact_site():
     )
     yield site
     Site.objects.clear_cache()
+    clear_site_snapshot()
 
 
 @override_settings(
@@ -1,5 +1,4 @@
 from django.conf import settings
-from django.contrib.sites.shortcuts import get_current_site
 from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
 from rest_framework import generics
@@ -7,16 +6,20 @@ from rest_framework.permissions import AllowAny
 
 from config.email import get_request_from_email
 from contact import serializers
+from sites.utils import get_site_entry
 
 
 class SubmitContactView(generics.CreateAPIView):
     serializer_class = serializers.ContactSubmissionSerializer
     queryset = serializers.ContactSubmission.objects.all()
     permission_classes = [AllowAny]
+    query_budget = 1
 
     def perform_create(self, serializer):
-        site = get_current_site(self.request)
-        submission = serializer.save(site=site)
+        site_entry = get_site_entry(self.request)
+        submission = serializer.save(
+            site=site_entry.site if site_entry is not None else None
+        )
         self._send_admin_notification(submission)
 
     def _send_admin_notification(self, submission):
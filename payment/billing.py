@@ -1,9 +1,11 @@
+import stripe
 from django.contrib.auth import get_user_model
 from django.db.models import Q
 from django.utils import timezone
 from rest_framework.exceptions import PermissionDenied
 
-from payment.models import Subscription
+from config.timing import timed_phase
+from payment.models import Account, Subscription
 
 User = get_user_model()
 
@@ -29,3 +31,28 @@ def require_within_hard_cap(
     # `cap <= 0` disables creation for that resource.
     if cap <= 0 or current_count >= cap:
         raise PermissionDenied(detail=detail)
+
+
+def _stripe_customer_params(account: Account) -> dict:
+    return {
+        "email": account.get_email,
+        "metadata": {"account_id": account.pk, "user_id": account.user_owner_id},
+        # Retries, the provisioning task and the lazy path at first payment all
+        # end up with the same customer.
+        "idempotency_key": f"account-{account.pk}-stripe-customer",
+    }
+
+
+def ensure_stripe_customer(account: Account) -> str:
+    """
+    Return the account's Stripe customer ID, creating the customer on first
+    use. Called when a payment needs it and by users.tasks.create_stripe_customer.
+    """
+    if not account.customer_id:
+        with timed_phase("stripe"):
+            customer = stripe.Customer.create(**_stripe_customer_params(account))
+        # Only the column, so a concurrent balance change is not overwritten.
+        Account.objects.filter(pk=account.pk).update(customer_id=customer.id)
+        account.customer_id = customer.id
+    return account.customer_id
+
@@ -0,0 +1,173 @@
+import math
+import os
+from datetime import datetime  # noqa: TC003
+from decimal import Decimal
+from typing import NamedTuple
+
+import redis
+import structlog
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from payment.models import Account
+
+logger = structlog.get_logger(__name__)
+
+# Bump when the shape of the cached record changes so workers running different
+# releases never read each other's entries.
+ENTITLEMENT_CACHE_VERSION = 1
+# Backstop for invalidations that were missed or raced with a load. Records of
+# active subscriptions never live past their expiration_date either way.
+ENTITLEMENT_TTL = int(os.environ.get("ENTITLEMENT_TTL", "300"))
+
+
+class Entitlement(NamedTuple):
+    balance: Decimal
+    subscription_type: str | None
+    expires_at: datetime | None
+
+    @property
+    def active_subscription(self) -> str | None:
+        """The subscription type while the subscription is active, like Subscription.is_active."""
+        if self.expires_at is not None and self.expires_at > timezone.now():
+            return self.subscription_type
+        return None
+
+    @property
+    def ttl(self) -> int:
+        if self.active_subscription is None:
+            return ENTITLEMENT_TTL
+        remaining = (self.expires_at - timezone.now()).total_seconds()
+        return max(1, min(ENTITLEMENT_TTL, math.ceil(remaining)))
+
+
+NO_ENTITLEMENT = Entitlement(
+    balance=Decimal(0), subscription_type=None, expires_at=None
+)
+
+
+def _entitlement_cache_key(user_id: int) -> str:
+    return f"entitlement:{user_id}"
+
+
+def _entitlement_queryset(user_id: int):
+    # Loads follow invalidations, so read the primary rather than a replica
+    # that may not have the change yet.
+    return (
+        Account.objects.using(DEFAULT_DB_ALIAS)
+        .select_related("subscription")
+        .filter(user_owner_id=user_id)
+    )
+
+
+def _build_entitlement(account: Account | None) -> Entitlement:
+    if account is None:
+        return NO_ENTITLEMENT
+    # A missing reverse one-to-one raises an AttributeError subclass.
+    subscription = getattr(account, "subscription", None)
+    if subscription is None:
+        return Entitlement(account.balance, None, None)
+    return Entitlement(
+        account.balance, subscription.subscription_type, subscription.expiration_date
+    )
+
+
+def _load_cached_entitlement(value) -> Entitlement | None:
+    # Stored as a plain tuple to keep the record small.
+    return Entitlement(*value) if value is not None else None
+
+
+def _store_entitlement(user_id: int, entitlement: Entitlement) -> None:
+    try:
+        cache.set(
+            _entitlement_cache_key(user_id),
+            tuple(entitlement),
+            timeout=entitlement.ttl,
+            version=ENTITLEMENT_CACHE_VERSION,
+        )
+    except redis.RedisError:
+        logger.warning("Could not cache entitlement", user_id=user_id, exc_info=True)
+
+
+async def _astore_entitlement(user_id: int, entitlement: Entitlement) -> None:
+    try:
+        await cache.aset(
+            _entitlement_cache_key(user_id),
+            tuple(entitlement),
+            timeout=entitlement.ttl,
+            version=ENTITLEMENT_CACHE_VERSION,
+        )
+    except redis.RedisError:
+        logger.warning("Could not cache entitlement", user_id=user_id, exc_info=True)
+
+
+def refresh_entitlement(user_id: int) -> Entitlement:
+    """Load the user's entitlement from the database and rewrite the cached record."""
+    entitlement = _build_entitlement(_entitlement_queryset(user_id).first())
+    _store_entitlement(user_id, entitlement)
+    return entitlement
+
+
+async def arefresh_entitlement(user_id: int) -> Entitlement:
+    entitlement = _build_entitlement(await _entitlement_queryset(user_id).afirst())
+    await _astore_entitlement(user_id, entitlement)
+    return entitlement
+
+
+def get_entitlement(user_id: int) -> Entitlement:
+    """
+    The balance and subscription of the user's personal account. Served from
+    Redis and loaded from the database on a miss or while Redis is unavailable.
+    """
+    try:
+        entitlement = _load_cached_entitlement(
+            cache.get(
+                _entitlement_cache_key(user_id), version=ENTITLEMENT_CACHE_VERSION
+            )
+        )
+    except redis.RedisError:
+        logger.warning(
+            "Could not read cached entitlement", user_id=user_id, exc_info=True
+        )
+        return _build_entitlement(_entitlement_queryset(user_id).first())
+    if entitlement is None:
+        entitlement = refresh_entitlement(user_id)
+    return entitlement
+
+
+async def aget_entitlement(user_id: int) -> Entitlement:
+    try:
+        entitlement = _load_cached_entitlement(
+            await cache.aget(
+                _entitlement_cache_key(user_id), version=ENTITLEMENT_CACHE_VERSION
+            )
+        )
+    except redis.RedisError:
+        logger.warning(
+            "Could not read cached entitlement", user_id=user_id, exc_info=True
+        )
+        return _build_entitlement(await _entitlement_queryset(user_id).afirst())
+    if entitlement is None:
+        entitlement = await arefresh_entitlement(user_id)
+    return entitlement
+
+
+def invalidate_entitlement(user_id: int) -> None:
+    try:
+        cache.delete(_entitlement_cache_key(user_id), version=ENTITLEMENT_CACHE_VERSION)
+    except redis.RedisError:
+        # The record expires on its own within ENTITLEMENT_TTL.
+        logger.exception("Could not invalidate entitlement", user_id=user_id)
+
+
+def invalidate_entitlement_on_commit(user_id: int, using: str | None = None) -> None:
+    transaction.on_commit(lambda: invalidate_entitlement(user_id), using=using)
+
+
+def refresh_entitlement_on_commit(user_id: int, using: str | None = None) -> None:
+    """
+    Rewrite the record once the change is committed, so clients polling right
+    after a purchase or renewal read the new subscription from Redis.
+    """
+    transaction.on_commit(lambda: refresh_entitlement(user_id), using=using)
@@ -31,6 +31,11 @@ class Account(UserOrTeamOwnershipMixin):
         raise ValueError(msg)
 
     async def has_active_subscription(self):
+        if self.user_owner_id is not None:
+            from payment.entitlements import aget_entitlement
+
+            entitlement = await aget_entitlement(self.user_owner_id)
+            return entitlement.active_subscription is not None
         subscription = await Subscription.objects.filter(account=self).afirst()
         return subscription.is_active() if subscription else False
 
@@ -0,0 +1,30 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .entitlements import invalidate_entitlement_on_commit
+from .models import Account, Subscription
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def invalidate_account_entitlement(sender, instance, using, **kwargs):
+    if instance.user_owner_id is not None:
+        invalidate_entitlement_on_commit(instance.user_owner_id, using=using)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_subscription_entitlement(sender, instance, using, **kwargs):
+    if Subscription.account.is_cached(instance):
+        user_id = instance.account.user_owner_id
+    else:
+        user_id = (
+            Account.objects.using(using)
+            .filter(pk=instance.account_id)
+            .values_list("user_owner_id", flat=True)
+            .first()
+        )
+    # Deleting an account cascades here after the account row is gone; the
+    # account's own post_delete covers that case.
+    if user_id is not None:
+        invalidate_entitlement_on_commit(user_id, using=using)
@@ -0,0 +1,106 @@
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+import redis
+import stripe
+from django.core.cache import cache
+from django.utils import timezone
+
+from config.queries import assert_query_budget
+from payment import entitlements
+from payment.entitlements import ENTITLEMENT_TTL, Entitlement, get_entitlement
+from payment.models import Subscription
+
+pytestmark = pytest.mark.django_db
+
+
+def test_entitlement_is_served_from_the_cache_after_the_first_read(
+    locmem_cache, subscriber
+):
+    with assert_query_budget(1):
+        entitlement = get_entitlement(subscriber.pk)
+    with assert_query_budget(0):
+        assert get_entitlement(subscriber.pk) == entitlement
+
+    assert entitlement.balance == Decimal("12.50")
+    assert entitlement.active_subscription == "pro"
+
+
+def test_account_and_subscription_saves_invalidate_the_entitlement(
+    locmem_cache, subscriber, django_capture_on_commit_callbacks
+):
+    get_entitlement(subscriber.pk)
+    account = subscriber.get_account()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        account.balance = Decimal(20)
+        account.save()
+    assert get_entitlement(subscriber.pk).balance == Decimal(20)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        Subscription.objects.filter(account=account).get().delete()
+    assert get_entitlement(subscriber.pk).active_subscription is None
+
+
+def test_entitlement_ttl_never_outlives_the_subscription():
+    expires_at = timezone.now() + timedelta(seconds=30)
+    entitlement = Entitlement(Decimal(0), "pro", expires_at)
+
+    assert entitlement.ttl <= 30
+    assert Entitlement(Decimal(0), None, None).ttl == ENTITLEMENT_TTL
+
+
+def test_cached_entitlement_stops_being_active_at_expiration(locmem_cache, subscriber):
+    subscription = Subscription.objects.get(account__user_owner=subscriber)
+    # Bypass the signals, as if an invalidation had been lost.
+    Subscription.objects.filter(pk=subscription.pk).update(
+        expiration_date=timezone.now() - timedelta(seconds=1)
+    )
+    cache.set(
+        f"entitlement:{subscriber.pk}",
+        (Decimal(0), "pro", timezone.now() - timedelta(seconds=1)),
+        version=entitlements.ENTITLEMENT_CACHE_VERSION,
+    )
+
+    assert get_entitlement(subscriber.pk).active_subscription is None
+
+
+def test_entitlement_falls_back_to_the_database_without_redis(
+    monkeypatch, locmem_cache, subscriber
+):
+    def unavailable(*args, **kwargs):
+        raise redis.RedisError
+
+    monkeypatch.setattr(locmem_cache, "get", unavailable)
+    monkeypatch.setattr(locmem_cache, "set", unavailable)
+
+    with assert_query_budget(1):
+        entitlement = get_entitlement(subscriber.pk)
+
+    assert entitlement.balance == Decimal("12.50")
+    assert entitlement.active_subscription == "pro"
+
+
+def test_stripe_webhook_rewrites_the_entitlement(
+    client, monkeypatch, locmem_cache, subscriber, django_capture_on_commit_callbacks
+):
+    account = subscriber.get_account()
+    account.customer_id = "cus_123"
+    account.save()
+    get_entitlement(subscriber.pk)
+    event = SimpleNamespace(
+        type="customer.subscription.deleted",
+        data=SimpleNamespace(object={"customer": "cus_123"}),
+    )
+    monkeypatch.setattr(stripe.Webhook, "construct_event", lambda *args: event)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(
+            "/api/stripe-webhook/", b"{}", content_type="application/json"
+        )
+
+    assert response.status_code == 200
+    with assert_query_budget(0):
+        assert get_entitlement(subscriber.pk).active_subscription is None
@@ -29,7 +29,6 @@ from appstoreserverlibrary.signed_data_verifier import (
     VerificationException,
 )
 from django.conf import settings
-from django.contrib.sites.shortcuts import get_current_site
 from django.http import JsonResponse
 from django.utils import timezone
 from drf_spectacular.utils import OpenApiTypes, extend_schema
@@ -39,8 +38,12 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from config.timing import timed_phase
 from payment import serializers
+from payment.billing import ensure_stripe_customer
+from payment.entitlements import refresh_entitlement_on_commit
 from payment.models import Account, Subscription
+from sites.utils import get_current_site_attributes
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
@@ -58,14 +61,16 @@ class AddValueView(generics.CreateAPIView):
         amount = serializer.validated_data["amount"]  # type: ignore
         account = request.user.get_account()
         try:
-            _ = stripe.PaymentIntent.create(
-                amount=int(amount * 100),
-                currency="usd",
-                payment_method=payment_method_id,
-                confirm=True,
-                customer=account.customer_id,
-                automatic_payment_methods={"enabled": True, "allow_redirects": "never"},
-            )
+            customer_id = ensure_stripe_customer(account)
+            with timed_phase("stripe"):
+                _ = stripe.PaymentIntent.create(
+                    amount=int(amount * 100),
+                    currency="usd",
+                    payment_method=payment_method_id,
+                    confirm=True,
+                    customer=customer_id,
+                    automatic_payment_methods={"enabled": True, "allow_redirects": "never"},
+                )
             account.balance += amount
             account.save()
             return JsonResponse({"success": True})
@@ -77,6 +82,16 @@ class AddValueView(generics.CreateAPIView):
                 error=e.user_message,
             )
             return JsonResponse({"error": e.user_message}, status=400)
+        except stripe.error.StripeError as e:
+            # Not the customer's fault: authentication, API or connection
+            # errors, including from creating the Stripe customer above.
+            logger.exception(
+                "Payment could not be processed",
+                user_id=request.user.id,
+                amount=amount,
+                error=str(e),
+            )
+            return JsonResponse({"error": "Payment could not be processed"}, status=502)
 
 
 class AddValueHistoryView(generics.ListAPIView):
@@ -84,9 +99,12 @@ class AddValueHistoryView(generics.ListAPIView):
 
     def get_queryset(self):
         # Get Stripe PaymentIntents
-        payment_intents = stripe.PaymentIntent.list(
-            customer=self.request.user.get_account().customer_id
-        )
+        customer_id = self.request.user.get_account().customer_id
+        if not customer_id:
+            # No Stripe customer yet, so nothing has been paid.
+            return []
+        with timed_phase("stripe"):
+            payment_intents = stripe.PaymentIntent.list(customer=customer_id)
         return [
             {
                 "date": datetime.fromtimestamp(pi.created, tz=UTC),
@@ -153,6 +171,8 @@ def get_create_apple_subscription(subscription_info: JWSTransactionDecodedPayloa
         subscription.platform_data = str(subscription_info)
         subscription.is_sandbox = environment == Environment.SANDBOX
         subscription.save()
+    if account.user_owner_id is not None:
+        refresh_entitlement_on_commit(account.user_owner_id)
 
     return subscription
 
@@ -202,6 +222,7 @@ def verify_and_decode_signed_transaction(signed_transaction):
 
 
 class AppleWebhookView(APIView):
+    authentication_classes = []
     permission_classes = [AllowAny]
 
     @extend_schema(
@@ -324,11 +345,6 @@ class StripeCustomerPortalView(APIView):
     )
     def post(self, request, *args, **kwargs):
         account = request.user.get_account()
-        if not account.customer_id:
-            return Response(
-                {"error": "No Stripe customer found"},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
 
         # Get the base URL from the current request
         protocol = "https" if request.is_secure() else "http"
@@ -339,10 +355,12 @@ class StripeCustomerPortalView(APIView):
         return_url = request.data.get("return_url", default_return_url)
 
         try:
-            session = stripe.billing_portal.Session.create(
-                customer=account.customer_id,
-                return_url=return_url,
-            )
+            customer_id = ensure_stripe_customer(account)
+            with timed_phase("stripe"):
+                session = stripe.billing_portal.Session.create(
+                    customer=customer_id,
+                    return_url=return_url,
+                )
             return Response({"url": session.url})
         except stripe.error.StripeError as e:
             logger.exception("Stripe portal session creation failed", error=str(e))
@@ -373,30 +391,29 @@ class StripeCheckoutView(APIView):
         # Allow override of success/cancel URLs but default to the current site
         success_url = request.data.get("success_url", f"{base_url}/settings/")
         cancel_url = request.data.get("cancel_url", f"{base_url}/settings/")
+        site_attributes = get_current_site_attributes(request)
 
         try:
-            session = stripe.checkout.Session.create(
-                customer=account.customer_id,
-                payment_method_types=["card"],
-                line_items=[
-                    {
-                        "price_data": {
-                            "product": get_current_site(
-                                request
-                            ).attributes.stripe_product_id,
-                            "recurring": {"interval": "month"},
-                            "currency": "usd",
-                            "unit_amount": get_current_site(
-                                request
-                            ).attributes.stripe_price_cents,
-                        },
-                        "quantity": 1,
-                    }
-                ],
-                mode="subscription",
-                success_url=success_url,
-                cancel_url=cancel_url,
-            )
+            customer_id = ensure_stripe_customer(account)
+            with timed_phase("stripe"):
+                session = stripe.checkout.Session.create(
+                    customer=customer_id,
+                    payment_method_types=["card"],
+                    line_items=[
+                        {
+                            "price_data": {
+                                "product": site_attributes.stripe_product_id,
+                                "recurring": {"interval": "month"},
+                                "currency": "usd",
+                                "unit_amount": site_attributes.stripe_price_cents,
+                            },
+                            "quantity": 1,
+                        }
+                    ],
+                    mode="subscription",
+                    success_url=success_url,
+                    cancel_url=cancel_url,
+                )
             return Response({"url": session.url})
         except stripe.error.StripeError as e:
             logger.exception("Stripe checkout session creation failed", error=str(e))
@@ -407,6 +424,7 @@ class StripeCheckoutView(APIView):
 
 
 class StripeWebhookView(APIView):
+    authentication_classes = []
     permission_classes = [AllowAny]
 
     @extend_schema(
@@ -480,4 +498,7 @@ class StripeWebhookView(APIView):
                 except Subscription.DoesNotExist:
                     pass
 
+            if account.user_owner_id is not None:
+                refresh_entitlement_on_commit(account.user_owner_id)
+
         return Response(status=status.HTTP_200_OK)
@@ -12,6 +12,8 @@ class SiteAttributesInline(admin.StackedInline):
         "admin_app_labels",
         "s3_frontend_folder",
         "s3_custom_domain",
+        "index_cache_soft_ttl",
+        "index_cache_hard_ttl",
         "stripe_product_id",
         "stripe_price_cents",
         "from_email",
@@ -6,3 +6,6 @@ class SitesConfig(AppConfig):
     name = "sites"
     label = "site_attributes"
     verbose_name = "Site Attributes"
+
+    def ready(self):
+        from . import signals  # noqa: F401, PLC0415
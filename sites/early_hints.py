@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.http.request import split_domain_port
+from django.urls import Resolver404, resolve
+
+from config.memory_cache import MemoryCache
+
+# Preload links of the shell last served for each host. Only hosts that passed
+# ALLOWED_HOSTS validation in serve_index are recorded.
+early_hint_links = MemoryCache(max_size=256, ttl=3600)
+
+
+def early_hints_host(host: str) -> str:
+    """
+    Key of a host in early_hint_links: its domain in lowercase without the
+    port, as sites are matched, so spellings of one host share their links.
+    """
+    domain, _ = split_domain_port(host)
+    return domain
+
+
+class EarlyHintsMiddleware:
+    """
+    ASGI middleware sending a 103 Early Hints response with the SPA shell's
+    preload links before Django runs, on servers that support the ASGI
+    ``http.response.early_hint`` extension. Other servers are unaffected.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and "http.response.early_hint" in scope.get(
+            "extensions", {}
+        ):
+            # The host Django's request.get_host() will see.
+            headers = dict(scope["headers"])
+            host = headers.get(b"host", b"")
+            if settings.USE_X_FORWARDED_HOST:
+                host = headers.get(b"x-forwarded-host", host)
+            links = early_hint_links.get(early_hints_host(host.decode("latin-1")))
+            if links and self._serves_index(scope["path"]):
+                await send(
+                    {
+                        "type": "http.response.early_hint",
+                        "links": [link.encode() for link in links],
+                    }
+                )
+        await self.app(scope, receive, send)
+
+    def _serves_index(self, path):
+        from sites.views import serve_index  # noqa: PLC0415
+
+        try:
+            return resolve(path).func is serve_index
+        except Resolver404:
+            return False
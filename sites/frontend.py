@@ -0,0 +1,399 @@
+import asyncio
+import functools
+import gzip
+import hashlib
+import itertools
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+import httpx
+import structlog
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+from config.http import get_http_client
+from config.memory_cache import MemoryCache
+
+logger = structlog.get_logger(__name__)
+
+ROOT_ASSET_URL_PREFIXES = (
+    "assets/",
+    "images/",
+    "favicon",
+    "manifest",
+    "site.webmanifest",
+    "vite.svg",
+)
+
+# Bump when the shape of CachedIndex changes so workers running different
+# releases never read each other's entries.
+INDEX_CACHE_VERSION = 7
+# Upper bound on how long a worker may hold the refresh lock for one index.
+INDEX_REFRESH_LOCK_TIMEOUT = 30
+# Seconds a cold request waits on the CDN before falling back to the mirror.
+INDEX_FETCH_LATENCY_BUDGET = float(os.environ.get("INDEX_FETCH_LATENCY_BUDGET", "0.5"))
+# Last good index.html of every frontend, served when the CDN is slow or down.
+INDEX_MIRROR_DIR = Path(
+    os.environ.get("INDEX_MIRROR_DIR")
+    or Path(tempfile.gettempdir()) / "api-core-index-mirror"
+)
+
+
+class IndexVariant(NamedTuple):
+    content: str | bytes
+    content_encoding: str
+    etag: str
+
+
+class CachedIndex(NamedTuple):
+    html: str
+    fresh_until: float
+    # When the hard TTL runs out. Every cache tier drops the copy by then, no
+    # matter when it was last read from Redis.
+    expires_at: float = 0.0
+    # Strong validator for the rewritten HTML we serve to browsers.
+    etag: str = ""
+    # Validators from the CDN, sent back on refresh so it can answer 304.
+    upstream_etag: str = ""
+    upstream_last_modified: str = ""
+    # Gzipped html, built once per refresh.
+    gzip: bytes = b""
+    # Link header values preloading the shell's /assets/ scripts and styles.
+    preload_links: tuple[str, ...] = ()
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.fresh_until
+
+    def remaining_ttl(self) -> float:
+        return self.expires_at - time.time()
+
+    def variant(self, accept_encoding: str) -> IndexVariant:
+        """
+        Serve the precompressed variant if the client accepts gzip. It gets its
+        own strong ETag since the bytes on the wire differ.
+        """
+        accepted_encodings = set()
+        for coding in accept_encoding.split(","):
+            name, _, params = coding.partition(";")
+            if not re.fullmatch(r"q=0(\.0{0,3})?", params.strip()):
+                accepted_encodings.add(name.strip().lower())
+        if self.gzip and "gzip" in accepted_encodings:
+            return IndexVariant(
+                content=self.gzip,
+                content_encoding="gzip",
+                etag=self.etag.removesuffix('"') + '-gzip"',
+            )
+        return IndexVariant(content=self.html, content_encoding="", etag=self.etag)
+
+
+class FrontendTarget(NamedTuple):
+    cdn_domain: str
+    frontend_folder: str
+    soft_ttl: int
+    hard_ttl: int
+
+    @property
+    def cache_key(self) -> str:
+        return f"index_html_cache_{self.cdn_domain}_{self.frontend_folder}"
+
+    @property
+    def index_url(self) -> str:
+        frontend_path = (
+            f"{self.frontend_folder}/index.html" if self.frontend_folder else "index.html"
+        )
+        return f"https://{self.cdn_domain}/{frontend_path}"
+
+
+def get_frontend_target(site_attributes) -> FrontendTarget:
+    frontend_folder = site_attributes.s3_frontend_folder.strip().strip("/")
+    cdn_domain = site_attributes.s3_custom_domain.strip()
+    if frontend_folder and not cdn_domain:
+        msg = "Deployment site is missing a public asset domain. Run deployment site sync again."
+        raise ImproperlyConfigured(msg)
+    if not cdn_domain:
+        cdn_domain = settings.AWS_S3_CUSTOM_DOMAIN.strip()
+    return FrontendTarget(
+        cdn_domain=cdn_domain,
+        frontend_folder=frontend_folder,
+        soft_ttl=site_attributes.index_cache_soft_ttl,
+        hard_ttl=site_attributes.index_cache_hard_ttl,
+    )
+
+
+# L1 in front of the Django (Redis) cache, keyed by the same cache_key so an
+# invalidation of one key applies to both tiers.
+local_index_cache = MemoryCache(
+    max_size=int(os.environ.get("INDEX_LOCAL_CACHE_SIZE", "128")),
+    ttl=3600,
+)
+
+# In-process single-flight: concurrent requests for the same key in this worker
+# await one fetch instead of each hitting the CDN.
+_inflight_fetches: dict[str, asyncio.Task] = {}
+# Strong references so background refreshes are not garbage collected mid-flight.
+_background_refreshes: set[asyncio.Task] = set()
+
+
+# Rewritten documents keyed by (upstream content hash, cdn_domain, frontend_folder)
+# so an unchanged upstream index.html is never rewritten twice.
+_rewritten_html_cache = MemoryCache(max_size=64, ttl=86400)
+# Indexes built from the mirror keyed by (path, mtime), so falling back to the
+# mirror only rebuilds them after it is rewritten.
+_mirrored_index_cache = MemoryCache(max_size=64, ttl=86400)
+
+
+@functools.lru_cache(maxsize=256)
+def _asset_url_replacement(cdn_domain: str, frontend_folder: str) -> str:
+    base_url = f"https://{cdn_domain}/{frontend_folder}" if frontend_folder else f"https://{cdn_domain}"
+    return f'="{base_url}/'
+
+
+def rewrite_root_asset_urls(html: str, *, cdn_domain: str, frontend_folder: str) -> str:
+    """
+    Point root-relative href/src asset URLs at the CDN in a single pass over
+    the document.
+    """
+    memo_key = (hashlib.sha256(html.encode()).hexdigest(), cdn_domain, frontend_folder)
+    rewritten_html = _rewritten_html_cache.get(memo_key)
+    if rewritten_html is not None:
+        return rewritten_html
+
+    replacement = _asset_url_replacement(cdn_domain, frontend_folder)
+    parts = html.split('="/')
+    rewritten_parts = [parts[0]]
+    for previous, part in itertools.pairwise(parts):
+        is_root_asset_url = previous.endswith(("href", "src")) and part.startswith(
+            ROOT_ASSET_URL_PREFIXES
+        )
+        rewritten_parts.append(replacement if is_root_asset_url else '="/')
+        rewritten_parts.append(part)
+    rewritten_html = "".join(rewritten_parts)
+
+    _rewritten_html_cache.set(memo_key, rewritten_html)
+    return rewritten_html
+
+
+_HTML_ASSET_TAG_PATTERN = re.compile(r"<(script|link)\b([^>]*)>")
+_HTML_ATTRIBUTE_PATTERN = re.compile(r'([\w-]+)(?:="([^"]*)")?')
+
+
+def get_preload_links(html: str) -> tuple[str, ...]:
+    """
+    Build Link header values for the /assets/ bundles the shell loads, so
+    browsers can start fetching them before parsing the HTML.
+    """
+    preload_links = []
+    for tag_name, raw_attributes in _HTML_ASSET_TAG_PATTERN.findall(html):
+        attributes = dict(_HTML_ATTRIBUTE_PATTERN.findall(raw_attributes))
+        url = attributes.get("src") or attributes.get("href") or ""
+        if "/assets/" not in url:
+            continue
+        is_module_script = tag_name == "script" and attributes.get("type") == "module"
+        if is_module_script or attributes.get("rel") == "modulepreload":
+            link = f"<{url}>; rel=modulepreload"
+        elif tag_name == "link" and attributes.get("rel") == "stylesheet":
+            link = f"<{url}>; rel=preload; as=style"
+        else:
+            continue
+        # The preload must use the same CORS mode as the tag or it is fetched twice.
+        if "crossorigin" in attributes:
+            link = f"{link}; crossorigin"
+        if link not in preload_links:
+            preload_links.append(link)
+    return tuple(preload_links)
+
+
+def build_cached_index(
+    html: str,
+    *,
+    fresh_until: float,
+    expires_at: float = 0.0,
+    upstream_etag: str = "",
+    upstream_last_modified: str = "",
+) -> CachedIndex:
+    encoded_html = html.encode()
+    return CachedIndex(
+        html=html,
+        fresh_until=fresh_until,
+        expires_at=expires_at,
+        etag=f'"{hashlib.sha256(encoded_html).hexdigest()[:32]}"',
+        upstream_etag=upstream_etag,
+        upstream_last_modified=upstream_last_modified,
+        gzip=gzip.compress(encoded_html, compresslevel=9, mtime=0),
+        preload_links=get_preload_links(html),
+    )
+
+
+def get_mirror_path(target: FrontendTarget) -> Path:
+    return INDEX_MIRROR_DIR / f"{hashlib.sha256(target.cache_key.encode()).hexdigest()[:32]}.html"
+
+
+def _write_mirror(target: FrontendTarget, html: str) -> None:
+    mirror_path = get_mirror_path(target)
+    mirror_path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename so readers never see a partially written file.
+    temporary_path = mirror_path.with_suffix(f".{os.getpid()}.tmp")
+    temporary_path.write_text(html)
+    temporary_path.replace(mirror_path)
+
+
+def _cache_locally(target: FrontendTarget, cached_index: CachedIndex) -> None:
+    # Only for the time the copy has left, so re-reading it from Redis does not
+    # extend its lifetime in this worker.
+    remaining_ttl = cached_index.remaining_ttl()
+    if remaining_ttl > 0:
+        local_index_cache.set(target.cache_key, cached_index, ttl=remaining_ttl)
+
+
+def _build_mirrored_index(mirror_path: Path) -> CachedIndex:
+    return build_cached_index(mirror_path.read_text(), fresh_until=0)
+
+
+async def read_mirror(target: FrontendTarget) -> CachedIndex | None:
+    """
+    Return the last good index.html mirrored to local disk, marked stale so it
+    is replaced as soon as the CDN answers again.
+    """
+    mirror_path = get_mirror_path(target)
+    try:
+        memo_key = (mirror_path, (await asyncio.to_thread(mirror_path.stat)).st_mtime_ns)
+        cached_index = _mirrored_index_cache.get(memo_key)
+        if cached_index is None:
+            # Hashing and gzipping stay off the event loop, which is busy
+            # exactly when the CDN is slow or down.
+            cached_index = await asyncio.to_thread(_build_mirrored_index, mirror_path)
+            _mirrored_index_cache.set(memo_key, cached_index)
+    except FileNotFoundError:
+        return None
+    cached_index = cached_index._replace(expires_at=time.time() + target.hard_ttl)
+    _cache_locally(target, cached_index)
+    return cached_index
+
+
+async def fetch_index(
+    target: FrontendTarget, previous: CachedIndex | None = None
+) -> CachedIndex:
+    headers = {}
+    if previous is not None and previous.upstream_etag:
+        headers["If-None-Match"] = previous.upstream_etag
+    if previous is not None and previous.upstream_last_modified:
+        headers["If-Modified-Since"] = previous.upstream_last_modified
+
+    response = await get_http_client().get(target.index_url, headers=headers)
+    upstream_etag = response.headers.get(
+        "ETag", previous.upstream_etag if previous is not None else ""
+    )
+    upstream_last_modified = response.headers.get(
+        "Last-Modified",
+        previous.upstream_last_modified if previous is not None else "",
+    )
+    fetched_at = time.time()
+    # The hard TTL is the total lifetime of a fetched copy, never shorter than
+    # the time it is served as fresh.
+    lifetime = max(target.hard_ttl, target.soft_ttl)
+    if previous is not None and response.status_code == 304:
+        cached_index = previous._replace(
+            fresh_until=fetched_at + target.soft_ttl,
+            expires_at=fetched_at + lifetime,
+            upstream_etag=upstream_etag,
+            upstream_last_modified=upstream_last_modified,
+        )
+    else:
+        response.raise_for_status()
+        cached_index = build_cached_index(
+            rewrite_root_asset_urls(
+                response.text,
+                cdn_domain=target.cdn_domain,
+                frontend_folder=target.frontend_folder,
+            ),
+            fresh_until=fetched_at + target.soft_ttl,
+            expires_at=fetched_at + lifetime,
+            upstream_etag=upstream_etag,
+            upstream_last_modified=upstream_last_modified,
+        )
+        await asyncio.to_thread(_write_mirror, target, cached_index.html)
+
+    await cache.aset(
+        target.cache_key, cached_index, lifetime, version=INDEX_CACHE_VERSION
+    )
+    _cache_locally(target, cached_index)
+    return cached_index
+
+
+def _single_flight_task(
+    target: FrontendTarget, previous: CachedIndex | None = None
+) -> asyncio.Task:
+    loop = asyncio.get_running_loop()
+    task = _inflight_fetches.get(target.cache_key)
+    if task is None or task.done() or task.get_loop() is not loop:
+        task = loop.create_task(fetch_index(target, previous))
+        _inflight_fetches[target.cache_key] = task
+
+        def forget_fetch(done):
+            if _inflight_fetches.get(target.cache_key) is done:
+                del _inflight_fetches[target.cache_key]
+
+        task.add_done_callback(forget_fetch)
+    return task
+
+
+async def _refresh_index(target: FrontendTarget, previous: CachedIndex) -> None:
+    lock_key = f"{target.cache_key}_refresh_lock"
+    # Cross-worker single-flight: only the worker that wins the lock refetches.
+    if not await cache.aadd(
+        lock_key, 1, INDEX_REFRESH_LOCK_TIMEOUT, version=INDEX_CACHE_VERSION
+    ):
+        return
+    try:
+        await _single_flight_task(target, previous)
+    except Exception:
+        # The stale copy keeps being served until its hard TTL runs out.
+        logger.exception("Background index refresh failed", url=target.index_url)
+    finally:
+        await cache.adelete(lock_key, version=INDEX_CACHE_VERSION)
+
+
+async def _fetch_within_latency_budget(target: FrontendTarget) -> CachedIndex:
+    task = _single_flight_task(target)
+    try:
+        # Shield so neither the budget nor a cancelled request cancels the
+        # fetch that other requests (and the caches) are waiting on.
+        return await asyncio.wait_for(asyncio.shield(task), INDEX_FETCH_LATENCY_BUDGET)
+    except TimeoutError:
+        mirrored_index = await read_mirror(target)
+        if mirrored_index is None:
+            return await asyncio.shield(task)
+        logger.warning("Serving mirrored index.html, CDN is slow", url=target.index_url)
+        return mirrored_index
+    except httpx.HTTPError:
+        mirrored_index = await read_mirror(target)
+        if mirrored_index is None:
+            raise
+        logger.exception("Serving mirrored index.html, CDN fetch failed", url=target.index_url)
+        return mirrored_index
+
+
+async def get_index(target: FrontendTarget) -> CachedIndex:
+    """
+    Return the rewritten index.html for a frontend, serving a stale copy while
+    it is refreshed in the background once its soft TTL has passed.
+    """
+    cached_index = local_index_cache.get(target.cache_key)
+    if cached_index is None or not cached_index.is_fresh():
+        # Another worker may already have refreshed the shared copy.
+        shared_index = await cache.aget(target.cache_key, version=INDEX_CACHE_VERSION)
+        if shared_index is not None:
+            cached_index = shared_index
+            _cache_locally(target, cached_index)
+    if cached_index is None:
+        return await _fetch_within_latency_budget(target)
+    if not cached_index.is_fresh() and target.cache_key not in _inflight_fetches:
+        task = asyncio.get_running_loop().create_task(_refresh_index(target, cached_index))
+        _background_refreshes.add(task)
+        task.add_done_callback(_background_refreshes.discard)
+    return cached_index
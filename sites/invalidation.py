@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+import redis.asyncio
+import structlog
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.db import transaction
+from django_redis import get_redis_connection
+
+from config.db import arelease_database_connections
+
+from . import frontend, utils
+
+logger = structlog.get_logger(__name__)
+
+SITE_INVALIDATION_CHANNEL = "sites:invalidate"
+# Seconds to wait before resubscribing after the Redis connection drops.
+LISTENER_RECONNECT_DELAY = 1
+
+_listener_task: asyncio.Task | None = None
+
+
+def apply_site_invalidation(*, index_cache_keys: list[str]) -> None:
+    """
+    Drop this worker's in-process copies of site and frontend data so the next
+    request re-reads them from Redis or the database.
+    """
+    for cache_key in index_cache_keys:
+        frontend.local_index_cache.delete(cache_key)
+    utils.clear_site_snapshot()
+    Site.objects.clear_cache()
+
+
+def publish_site_invalidation(*, index_cache_keys: list[str]) -> None:
+    apply_site_invalidation(index_cache_keys=index_cache_keys)
+    get_redis_connection("default").publish(
+        SITE_INVALIDATION_CHANNEL,
+        json.dumps({"index_cache_keys": index_cache_keys}),
+    )
+
+
+def publish_site_invalidation_on_commit() -> None:
+    """
+    Drop this worker's site caches now and tell the other workers once the
+    change is committed. If Redis is unreachable, other workers catch up when
+    their entries expire.
+    """
+    apply_site_invalidation(index_cache_keys=[])
+
+    def publish():
+        try:
+            publish_site_invalidation(index_cache_keys=[])
+        except redis.RedisError:
+            logger.exception("Could not publish site invalidation")
+
+    transaction.on_commit(publish)
+
+
+async def _handle_site_invalidation(message) -> None:
+    try:
+        payload = json.loads(message["data"])
+        apply_site_invalidation(index_cache_keys=payload["index_cache_keys"])
+        # Reload straight away so requests keep hitting a snapshot.
+        await utils.aget_site_snapshot()
+        await arelease_database_connections()
+    except Exception:
+        # A bad message or a failed reload must not stop the listener; the
+        # snapshot, if dropped, is loaded again by the next request.
+        logger.exception("Could not apply site invalidation", data=message["data"])
+        return
+    logger.info("Applied site invalidation", **payload)
+
+
+async def listen_for_site_invalidations() -> None:
+    while True:
+        try:
+            async with (
+                redis.asyncio.Redis.from_url(settings.REDIS_URL) as client,
+                client.pubsub(ignore_subscribe_messages=True) as pubsub,
+            ):
+                await pubsub.subscribe(SITE_INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    await _handle_site_invalidation(message)
+        except redis.RedisError:
+            # Keep the worker serving; it falls back to TTL expiry until the
+            # subscription is re-established.
+            logger.exception("Site invalidation listener disconnected")
+            await asyncio.sleep(LISTENER_RECONNECT_DELAY)
+
+
+async def start_site_invalidation_listener() -> None:
+    global _listener_task  # noqa: PLW0603
+    _listener_task = asyncio.get_running_loop().create_task(
+        listen_for_site_invalidations()
+    )
+
+
+async def stop_site_invalidation_listener() -> None:
+    global _listener_task  # noqa: PLW0603
+    if _listener_task is None:
+        return
+    _listener_task.cancel()
+    _listener_task = None
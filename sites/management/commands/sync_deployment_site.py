@@ -1,6 +1,14 @@
+import contextlib
+
+import httpx
+from asgiref.sync import async_to_sync
 from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
 from django.core.management import BaseCommand, CommandError
 
+from sites import frontend
+from sites.invalidation import publish_site_invalidation
 from sites.models import SiteAttributes
 
 
@@ -19,6 +27,11 @@ class Command(BaseCommand):
             default="",
             help="Optional asset folder inside the configured bucket/CDN.",
         )
+        parser.add_argument(
+            "--prewarm",
+            action="store_true",
+            help="Fetch and cache the new index.html before reporting success.",
+        )
 
     def handle(self, *args, **options):
         domain = str(options["domain"]).strip().lower()
@@ -35,10 +48,41 @@ class Command(BaseCommand):
             "from_email": f"team@{domain}",
         }
 
+        index_cache_keys = set()
+        previous_attributes = SiteAttributes.objects.filter(site__domain=domain).first()
+        if previous_attributes is not None:
+            # A previously misconfigured site never had a cached index to drop.
+            with contextlib.suppress(ImproperlyConfigured):
+                index_cache_keys.add(
+                    frontend.get_frontend_target(previous_attributes).cache_key
+                )
+
         site, _created = Site.objects.update_or_create(
             domain=domain,
             defaults={"name": domain},
         )
-        SiteAttributes.objects.update_or_create(site=site, defaults=defaults)
+        site_attributes, _created = SiteAttributes.objects.update_or_create(
+            site=site, defaults=defaults
+        )
         Site.objects.clear_cache()
+
+        try:
+            target = frontend.get_frontend_target(site_attributes)
+        except ImproperlyConfigured as e:
+            if options["prewarm"]:
+                raise CommandError(str(e)) from e
+            target = None
+        if target is not None:
+            index_cache_keys.add(target.cache_key)
+        for cache_key in index_cache_keys:
+            cache.delete(cache_key, version=frontend.INDEX_CACHE_VERSION)
+
+        if options["prewarm"]:
+            try:
+                async_to_sync(frontend.fetch_index)(target)
+            except httpx.HTTPError as e:
+                msg = f"Failed to prewarm {target.index_url}: {e}"
+                raise CommandError(msg) from e
+
+        publish_site_invalidation(index_cache_keys=sorted(index_cache_keys))
         self.stdout.write(self.style.SUCCESS(f"Synced deployment site for {domain}"))
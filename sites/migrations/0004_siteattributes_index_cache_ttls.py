@@ -0,0 +1,23 @@
+# Generated by Django 5.2.10 on 2026-10-18 17:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('site_attributes', '0003_siteattributes_s3_custom_domain'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='siteattributes',
+            name='index_cache_hard_ttl',
+            field=models.PositiveIntegerField(default=3600, help_text='Seconds a fetched index.html is kept in total, including the time it is served stale while being refreshed. At least the soft TTL.'),
+        ),
+        migrations.AddField(
+            model_name='siteattributes',
+            name='index_cache_soft_ttl',
+            field=models.PositiveIntegerField(default=10, help_text='Seconds the cached index.html is served as fresh before it is refreshed in the background.'),
+        ),
+    ]
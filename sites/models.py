@@ -23,6 +23,14 @@ class SiteAttributes(models.Model):
         blank=True,
         help_text="Optional CDN domain for this site's frontend assets. Defaults to AWS_S3_CUSTOM_DOMAIN.",
     )
+    index_cache_soft_ttl = models.PositiveIntegerField(
+        default=10,
+        help_text="Seconds the cached index.html is served as fresh before it is refreshed in the background.",
+    )
+    index_cache_hard_ttl = models.PositiveIntegerField(
+        default=3600,
+        help_text="Seconds a fetched index.html is kept in total, including the time it is served stale while being refreshed. At least the soft TTL.",
+    )
     stripe_product_id = models.CharField(
         max_length=255,
         blank=True,
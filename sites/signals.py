@@ -0,0 +1,14 @@
+from django.contrib.sites.models import Site
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .invalidation import publish_site_invalidation_on_commit
+from .models import SiteAttributes
+
+
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+@receiver(post_save, sender=SiteAttributes)
+@receiver(post_delete, sender=SiteAttributes)
+def invalidate_site_caches(sender, **kwargs):
+    publish_site_invalidation_on_commit()
@@ -1,20 +1,43 @@
+import asyncio
+import functools
+import gzip
+import json
+import time
+import timeit
+
+import httpx
 import pytest
+import structlog
 from allauth.socialaccount.models import SocialApp
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib import admin
 from django.contrib.sites.models import Site
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.management import call_command
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError
+from django.http import HttpResponse
 from django.test import override_settings
 from django.urls import path
 
-from contact.models import ContactSubmission
+from config import http as config_http
 from config.admin import site as dynamic_admin_site
+from config.context_processors import global_settings
+from config.email import get_request_from_email
+from config.middlewares import site_snapshot_middleware
+from contact.models import ContactSubmission
+from sites import frontend
+from sites import invalidation as site_invalidation
+from sites import utils as site_utils
+from sites import views as site_views
+from sites.early_hints import EarlyHintsMiddleware, early_hint_links
 from sites.models import SiteAttributes
 
 urlpatterns = [
     path("admin/", dynamic_admin_site.urls),
+    path("", site_views.serve_index, {"resource": ""}),
 ]
 
-
 pytestmark = pytest.mark.django_db
 
 
@@ -22,6 +45,77 @@ pytestmark = pytest.mark.django_db
 def clear_site_cache():
     yield
     Site.objects.clear_cache()
+    site_utils.clear_site_snapshot()
+
+
+@pytest.fixture
+def published_invalidations(monkeypatch):
+    """Record site invalidations instead of publishing them to Redis."""
+
+    class FakeRedis:
+        def __init__(self):
+            self.messages = []
+
+        def publish(self, channel, message):
+            self.messages.append((channel, json.loads(message)))
+
+    fake_redis = FakeRedis()
+    monkeypatch.setattr(site_invalidation, "get_redis_connection", lambda alias: fake_redis)
+    return fake_redis.messages
+
+
+@pytest.fixture
+def cdn(monkeypatch, tmp_path):
+    """Serve upstream index.html fetches from an in-memory CDN."""
+
+    class FakeCDN:
+        def __init__(self):
+            self.files = {}
+            self.requests = []
+            self.delay = 0
+            self.down = False
+            self.unreachable = False
+
+        async def handler(self, request):
+            self.requests.append(request)
+            await asyncio.sleep(self.delay)
+            if self.unreachable:
+                msg = "Connection refused"
+                raise httpx.ConnectError(msg, request=request)
+            if self.down:
+                return httpx.Response(503)
+            if str(request.url) not in self.files:
+                return httpx.Response(404)
+            text = self.files[str(request.url)]
+            etag = f'"{len(text)}-{hash(text)}"'
+            if request.headers.get("If-None-Match") == etag:
+                return httpx.Response(304, headers={"ETag": etag})
+            return httpx.Response(200, text=text, headers={"ETag": etag})
+
+    fake_cdn = FakeCDN()
+    monkeypatch.setattr(
+        config_http,
+        "create_http_client",
+        functools.partial(
+            config_http.create_http_client,
+            transport=httpx.MockTransport(fake_cdn.handler),
+        ),
+    )
+    monkeypatch.setattr(config_http, "_client", None)
+    monkeypatch.setattr(config_http, "_client_loop", None)
+    monkeypatch.setattr(frontend, "INDEX_MIRROR_DIR", tmp_path / "index-mirror")
+    return fake_cdn
+
+
+@pytest.fixture
+def frontend_site():
+    site = Site.objects.create(domain="app.example.com", name="App Example")
+    SiteAttributes.objects.create(
+        site=site,
+        s3_custom_domain="cdn.example.com",
+        s3_frontend_folder="sites/app",
+    )
+    return site
 
 
 @override_settings(
@@ -41,6 +135,29 @@ def test_get_app_list_filters_to_allowed_site_app_labels(rf):
     assert [app["app_label"] for app in app_list] == ["teams", "users"]
 
 
+@override_settings(
+    ROOT_URLCONF="sites.tests",
+    ALLOWED_HOSTS=["admin.example.com"],
+    SITE_ID=None,
+)
+def test_get_app_list_normalizes_labels_and_scopes_app_index(rf, django_assert_num_queries):
+    site = Site.objects.create(domain="admin.example.com", name="Admin Example")
+    SiteAttributes.objects.create(site=site, admin_app_labels=[" users ", "", 3])
+    site_utils.get_site_snapshot()
+
+    request = rf.get("/admin/", HTTP_HOST=site.domain)
+    request.user = _AdminTestUser()
+
+    with django_assert_num_queries(0):
+        app_list = dynamic_admin_site.get_app_list(request)
+        users_index = dynamic_admin_site.get_app_list(request, "users")
+        teams_index = dynamic_admin_site.get_app_list(request, "teams")
+
+    assert [app["app_label"] for app in app_list] == ["users"]
+    assert [app["app_label"] for app in users_index] == ["users"]
+    assert teams_index == []
+
+
 @override_settings(
     ROOT_URLCONF="sites.tests",
     ALLOWED_HOSTS=["admin.example.com"],
@@ -58,6 +175,153 @@ def test_get_app_list_shows_all_apps_when_site_has_no_restrictions(rf):
     assert {"users", "teams", "payment"}.issubset(app_labels)
 
 
+@override_settings(
+    ROOT_URLCONF="sites.tests",
+    ALLOWED_HOSTS=["one.example.com", "two.example.com"],
+    SITE_ID=None,
+)
+def test_admin_branding_follows_each_request_site(client):
+    for domain, name in [("one.example.com", "One"), ("two.example.com", "Two")]:
+        Site.objects.create(domain=domain, name=name)
+    default_header = dynamic_admin_site.site_header
+
+    first = client.get("/admin/login/", HTTP_HOST="one.example.com")
+    second = client.get("/admin/login/", HTTP_HOST="two.example.com")
+
+    assert first.context["site_header"] == "One Admin"
+    assert second.context["site_title"] == "Two Admin"
+    assert b"Two Admin" in second.content
+    assert dynamic_admin_site.site_header == default_header
+
+
+@override_settings(ALLOWED_HOSTS=["app.example.com"], SITE_ID=None)
+def test_site_snapshot_is_replaced_when_attributes_change(rf, frontend_site):
+    request = rf.get("/", HTTP_HOST=frontend_site.domain)
+
+    snapshot = site_utils.get_site_snapshot()
+    cached_attributes = site_utils.get_current_site_attributes(request)
+    assert site_utils.get_site_snapshot() is snapshot
+
+    cached_attributes.save()
+
+    assert site_utils.get_site_snapshot() is not snapshot
+    request = rf.get("/", HTTP_HOST=frontend_site.domain)
+    assert site_utils.get_current_site_attributes(request) is not cached_attributes
+
+
+@override_settings(ALLOWED_HOSTS=["*"], SITE_ID=None)
+def test_site_snapshot_stats_count_lookups_and_loads(rf, frontend_site, monkeypatch):
+    counts = {"hits": 0, "misses": 0, "unresolved": 0}
+    monkeypatch.setattr(site_utils, "_site_snapshot_counts", counts)
+    site_utils.clear_site_snapshot()
+
+    site_utils.get_site_entry(rf.get("/", HTTP_HOST=frontend_site.domain))
+    site_utils.get_site_entry(rf.get("/", HTTP_HOST="scanner.example.com"))
+
+    stats = site_utils.get_site_snapshot_stats()
+    assert stats.sites == Site.objects.count()
+    assert (stats.hits, stats.misses, stats.unresolved) == (1, 1, 1)
+    assert stats.hit_rate == 0.5
+    assert stats.loaded_at <= time.time()
+
+
+def test_async_site_snapshot_load_releases_its_database_connection(monkeypatch):
+    releases = []
+    monkeypatch.setattr(
+        site_utils, "close_old_connections", lambda: releases.append(True)
+    )
+    site_utils.clear_site_snapshot()
+
+    async_to_sync(site_utils.aget_site_snapshot)()
+
+    assert releases == [True]
+
+
+def test_site_invalidation_listener_survives_a_failed_reload(monkeypatch):
+    async def failing_reload():
+        raise DatabaseError
+
+    message = {"data": json.dumps({"index_cache_keys": []})}
+    monkeypatch.setattr(site_utils, "aget_site_snapshot", failing_reload)
+    with structlog.testing.capture_logs() as logs:
+        async_to_sync(site_invalidation._handle_site_invalidation)(message)  # noqa: SLF001
+        async_to_sync(site_invalidation._handle_site_invalidation)({"data": "{"})  # noqa: SLF001
+
+    assert [log["event"] for log in logs] == ["Could not apply site invalidation"] * 2
+
+
+@override_settings(ALLOWED_HOSTS=["*"], SITE_ID=None)
+def test_site_snapshot_resolves_hosts_like_django_sites(rf, frontend_site):
+    bare_site = Site.objects.create(domain="bare.example.com", name="Bare")
+    snapshot = site_utils.get_site_snapshot()
+
+    with_port = snapshot.resolve(rf.get("/", HTTP_HOST="APP.example.com:8000"))
+    without_attributes = snapshot.resolve(rf.get("/", HTTP_HOST=bare_site.domain))
+
+    assert with_port.site == frontend_site
+    assert with_port.attributes.site_id == frontend_site.pk
+    assert without_attributes == (bare_site, None, None)
+    assert snapshot.resolve(rf.get("/", HTTP_HOST="unknown.example.com")) is None
+
+
+@override_settings(ALLOWED_HOSTS=["app.example.com"], SITE_ID=None)
+def test_async_site_resolution_stays_on_the_event_loop(
+    rf, frontend_site, thread_hops, monkeypatch
+):
+    async def resolve_attributes():
+        return [
+            await site_utils.aget_current_site_attributes(
+                rf.get("/", HTTP_HOST=frontend_site.domain)
+            )
+            for _ in range(10)
+        ]
+
+    cold_attributes = async_to_sync(resolve_attributes)()
+    cold_hops = thread_hops["sync_to_async"]
+    warm_attributes = async_to_sync(resolve_attributes)()
+
+    assert cold_hops == 1
+    assert thread_hops["sync_to_async"] == cold_hops
+    assert warm_attributes == cold_attributes
+
+    monkeypatch.setattr(site_utils, "SITE_SNAPSHOT_TTL", 0)
+    site_utils.clear_site_snapshot()
+    expired_snapshot = site_utils.get_site_snapshot()
+
+    async def resolve_while_expired():
+        snapshot = await site_utils.aget_site_snapshot()
+        await asyncio.gather(*site_utils._site_snapshot_loads.values())
+        return snapshot
+
+    assert async_to_sync(resolve_while_expired)() is expired_snapshot
+    assert site_utils.get_site_snapshot() is not expired_snapshot
+
+
+@override_settings(
+    ROOT_URLCONF="sites.tests",
+    ALLOWED_HOSTS=["admin.example.com"],
+    SITE_ID=None,
+)
+def test_site_consumers_share_one_resolved_entry(rf, django_assert_num_queries):
+    site = Site.objects.create(domain="admin.example.com", name="Admin Example")
+    SiteAttributes.objects.create(
+        site=site, admin_app_labels=["users"], from_email="team@example.com"
+    )
+    request = rf.get("/admin/", HTTP_HOST=site.domain)
+    request.user = _AdminTestUser()
+
+    with django_assert_num_queries(1):
+        site_snapshot_middleware(lambda request: HttpResponse())(request)
+        product_name = global_settings(request)["product_name"]
+        from_email = get_request_from_email(request)
+        app_list = dynamic_admin_site.get_app_list(request)
+
+    assert request.site_entry.site == site
+    assert product_name == "Admin Example"
+    assert from_email == "Admin Example <team@example.com>"
+    assert [app["app_label"] for app in app_list] == ["users"]
+
+
 @override_settings(ALLOWED_HOSTS=["localhost", "other.example.com"], DEBUG=True, SITE_ID=1)
 def test_debug_site_id_always_uses_default_site(rf):
     call_command("ensure_default_sites")
@@ -165,7 +429,9 @@ def test_ensure_default_sites_reads_allowed_hosts_from_environment(monkeypatch):
     assert not Site.objects.filter(domain="localhost", name="localhost").exclude(pk=1).exists()
 
 
-def test_sync_deployment_site_creates_site_and_attributes():
+def test_sync_deployment_site_creates_site_and_attributes(
+    locmem_cache, published_invalidations
+):
     call_command(
         "sync_deployment_site",
         "--domain",
@@ -185,7 +451,9 @@ def test_sync_deployment_site_creates_site_and_attributes():
     assert attributes.from_email == "team@deploy-abc.openbase.app"
 
 
-def test_sync_deployment_site_updates_existing_attributes():
+def test_sync_deployment_site_updates_existing_attributes(
+    locmem_cache, published_invalidations
+):
     site = Site.objects.create(domain="deploy-abc.openbase.app", name="Old Name")
     SiteAttributes.objects.create(
         site=site,
@@ -213,6 +481,543 @@ def test_sync_deployment_site_updates_existing_attributes():
     assert attributes.from_email == "team@deploy-abc.openbase.app"
 
 
+@override_settings(
+    ROOT_URLCONF="sites.tests",
+    ALLOWED_HOSTS=["app.example.com"],
+    SITE_ID=None,
+)
+def test_serve_index_fetches_and_rewrites_upstream_html(
+    client, cdn, locmem_cache, frontend_site
+):
+    cdn.files["https://cdn.example.com/sites/app/index.html"] = (
+        '<script type="module" src="/assets/index-abc.js"></script>'
+    )
+
+    first = client.get("/", HTTP_HOST=frontend_site.domain)
+    second = client.get("/", HTTP_HOST=frontend_site.domain)
+
+    assert first.status_code == 200
+    assert first.content == second.content
+    assert b'src="https://cdn.example.com/sites/app/assets/index-abc.js"' in first.content
+    assert len(cdn.requests) == 1
+
+
+@override_settings(
+    ROOT_URLCONF="sites.tests",
+    ALLOWED_HOSTS=["app.example.com"],
+    SITE_ID=None,
+)
+def test_serve_index_answers_bad_gateway_when_cdn_is_unreachable(
+    client, cdn, locmem_cache, frontend_site
+):
+    cdn.unreachable = True
+
+    response = client.get("/", HTTP_HOST=frontend_site.domain)
+
+    assert response.status_code == 502
+
+
+def test_shared_http_client_is_reused_within_an_event_loop(cdn):
+    async def fetch_twice():
+        client = config_http.get_http_client()
+        await client.get("https://cdn.example.com/index.html")
+        await config_http.get_http_client().get("https://cdn.example.com/index.html")
+        return client is config_http.get_http_client()
+
+    requests_before = config_http.get_http_pool_stats().requests
+
+    assert async_to_sync(fetch_twice)()
+    assert config_http.get_http_pool_stats().requests == requests_before + 2
+
+
+def test_shared_http_client_is_closed_when_replaced_on_another_event_loop(cdn):
+    async def get_client():
+        client = config_http.get_http_client()
+        await asyncio.gather(*config_http._closing_clients)
+        return client
+
+    first_client = async_to_sync(get_client)()
+    second_client = async_to_sync(get_client)()
+
+    assert second_client is not first_client
+    assert first_client.is_closed
+    assert not second_client.is_closed
+
+
+@override_settings(
+    ROOT_URLCONF="sites.tests",
+    ALLOWED_HOSTS=["app.example.com"],
+    SITE_ID=None,
+)
+def test_serve_index_answers_matching_if_none_match_with_not_modified(
+    client, cdn, locmem_cache, frontend_site
+):
+    cdn.files["https://cdn.example.com/sites/app/index.html"] = "<html></html>"
+
+    first = client.get("/", HTTP_HOST=frontend_site.domain)
+    revalidated = client.get(
+        "/", HTTP_HOST=frontend_site.domain, HTTP_IF_NONE_MATCH=first["ETag"]
+    )
+    mismatched = client.get(
+        "/", HTTP_HOST=frontend_site.domain, HTTP_IF_NONE_MATCH='"something-else"'
+    )
+
+    assert first.status_code == 200
+    assert first["ETag"].startswith('"')
+    assert revalidated.status_code == 304
+    assert revalidated["ETag"] == first["ETag"]
+    assert revalidated.content == b""
+    assert mismatched.status_code == 200
+
+
+@override_settings(
+    ROOT_URLCONF="sites.tests",
+    ALLOWED_HOSTS=["app.example.com"],
+    SITE_ID=None,
+)
+def test_serve_index_serves_precompressed_variant_for_accept_encoding(
+    client, cdn, locmem_cache, frontend_site
+):
+    cdn.files["https://cdn.example.com/sites/app/index.html"] = "<html></html>"
+
+    identity = client.get("/", HTTP_HOST=frontend_site.domain)
+    gzipped = client.get(
+        "/", HTTP_HOST=frontend_site.domain, HTTP_ACCEPT_ENCODING="gzip, br;q=0"
+    )
+
+    assert "Content-Encoding" not in identity
+    assert gzipped["Content-Encoding"] == "gzip"
+    assert gzip.decompress(gzipped.content) == identity.content
+    assert gzipped["ETag"] != identity["ETag"]
+    assert "Accept-Encoding" in gzipped["Vary"]
+    assert len(cdn.requests) == 1
+
+
+def test_cached_index_serves_gzip_only_when_accepted():
+    cached_index = frontend.CachedIndex(
+        html="<html></html>",
+        fresh_until=0,
+        etag='"abc"',
+        gzip=gzip.compress(b"<html></html>"),
+    )
+
+    variant = cached_index.variant("deflate, GZIP, br")
+
+    assert variant.content_encoding == "gzip"
+    assert variant.etag == '"abc-gzip"'
+    assert gzip.decompress(variant.content) == b"<html></html>"
+    assert cached_index.variant("gzip;q=0, br").content == "<html></html>"
+    assert cached_index.variant("identity").content == "<html></html>"
+
+
+INDEX_URL = "https://cdn.example.com/sites/app/index.html"
+FRONTEND_TARGET = frontend.FrontendTarget(
+    cdn_domain="cdn.example.com",
+    frontend_folder="sites/app",
+    soft_ttl=10,
+    hard_ttl=3600,
+)
+
+
+def test_get_index_coalesces_concurrent_misses(cdn, locmem_cache):
+    cdn.files[INDEX_URL] = "<html></html>"
+
+    async def get_concurrently():
+        return await asyncio.gather(
+            *(frontend.get_index(FRONTEND_TARGET) for _ in range(5))
+        )
+
+    cached_indexes = async_to_sync(get_concurrently)()
+
+    assert {cached_index.html for cached_index in cached_indexes} == {"<html></html>"}
+    assert len(cdn.requests) == 1
+
+
+def test_get_index_serves_repeat_requests_from_local_cache(cdn, locmem_cache):
+    cdn.files[INDEX_URL] = "<html></html>"
+    hits_before = frontend.local_index_cache.stats().hits
+
+    async_to_sync(frontend.get_index)(FRONTEND_TARGET)
+    cache.delete(FRONTEND_TARGET.cache_key, version=frontend.INDEX_CACHE_VERSION)
+    cached_index = async_to_sync(frontend.get_index)(FRONTEND_TARGET)
+
+    assert cached_index.html == "<html></html>"
+    assert frontend.local_index_cache.stats().hits == hits_before + 1
+    assert len(cdn.requests) == 1
+
+
+def test_get_index_serves_stale_copy_and_refreshes_in_background(cdn, locmem_cache):
+    cdn.files[INDEX_URL] = "<html>new</html>"
+    cache.set(
+        FRONTEND_TARGET.cache_key,
+        frontend.CachedIndex(html="<html>old</html>", fresh_until=time.time() - 1),
+        version=frontend.INDEX_CACHE_VERSION,
+    )
+
+    async def get_and_wait_for_refresh():
+        cached_index = await frontend.get_index(FRONTEND_TARGET)
+        await asyncio.gather(*frontend._background_refreshes)
+        return cached_index
+
+    stale_index = async_to_sync(get_and_wait_for_refresh)()
+    refreshed_index = cache.get(
+        FRONTEND_TARGET.cache_key, version=frontend.INDEX_CACHE_VERSION
+    )
+
+    assert stale_index.html == "<html>old</html>"
+    assert refreshed_index.html == "<html>new</html>"
+    assert refreshed_index.is_fresh()
+    assert len(cdn.requests) == 1
+
+
+def test_get_index_keeps_a_shared_copy_locally_only_until_its_hard_ttl(
+    cdn, locmem_cache
+):
+    cache.set(
+        FRONTEND_TARGET.cache_key,
+        frontend.CachedIndex(
+            html="<html></html>",
+            fresh_until=time.time() + 5,
+            expires_at=time.time() + 5,
+        ),
+        version=frontend.INDEX_CACHE_VERSION,
+    )
+
+    async_to_sync(frontend.get_index)(FRONTEND_TARGET)
+
+    # Not the full hard TTL of the target, which would outlive the Redis copy.
+    local_expires_at, _ = frontend.local_index_cache._entries[FRONTEND_TARGET.cache_key]
+    assert local_expires_at - time.monotonic() <= 5
+    assert cdn.requests == []
+
+
+def test_get_index_revalidates_stale_copy_with_upstream_etag(cdn, locmem_cache):
+    cdn.files[INDEX_URL] = "<html></html>"
+    cached_index = async_to_sync(frontend.fetch_index)(FRONTEND_TARGET)
+    stale_index = cached_index._replace(fresh_until=time.time() - 1)
+
+    refreshed_index = async_to_sync(frontend.fetch_index)(FRONTEND_TARGET, stale_index)
+
+    assert cdn.requests[-1].headers["If-None-Match"] == cached_index.upstream_etag
+    assert refreshed_index.html == cached_index.html
+    assert refreshed_index.etag == cached_index.etag
+    assert refreshed_index.is_fresh()
+
+
+def test_fetch_index_mirrors_last_good_index_to_disk(cdn, locmem_cache):
+    cdn.files[INDEX_URL] = "<html>v1</html>"
+
+    async_to_sync(frontend.fetch_index)(FRONTEND_TARGET)
+
+    assert frontend.get_mirror_path(FRONTEND_TARGET).read_text() == "<html>v1</html>"
+
+
+def test_get_index_serves_mirror_when_cdn_is_down(cdn, locmem_cache):
+    cdn.files[INDEX_URL] = "<html>v1</html>"
+    async_to_sync(frontend.fetch_index)(FRONTEND_TARGET)
+    cache.clear()
+    frontend.local_index_cache.clear()
+    cdn.down = True
+
+    cached_index = async_to_sync(frontend.get_index)(FRONTEND_TARGET)
+
+    assert cached_index.html == "<html>v1</html>"
+    assert not cached_index.is_fresh()
+
+
+def test_read_mirror_builds_the_index_once_per_mirror_write(
+    cdn, locmem_cache, monkeypatch
+):
+    cdn.files[INDEX_URL] = "<html>v1</html>"
+    async_to_sync(frontend.fetch_index)(FRONTEND_TARGET)
+    builds = []
+    build_cached_index = frontend.build_cached_index
+
+    def counted_build(*args, **kwargs):
+        builds.append(args)
+        return build_cached_index(*args, **kwargs)
+
+    monkeypatch.setattr(frontend, "build_cached_index", counted_build)
+
+    first = async_to_sync(frontend.read_mirror)(FRONTEND_TARGET)
+    second = async_to_sync(frontend.read_mirror)(FRONTEND_TARGET)
+
+    assert second.gzip is first.gzip
+    assert len(builds) == 1
+
+
+def test_get_index_serves_mirror_when_cdn_exceeds_latency_budget(
+    cdn, locmem_cache, monkeypatch
+):
+    frontend.get_mirror_path(FRONTEND_TARGET).parent.mkdir(parents=True)
+    frontend.get_mirror_path(FRONTEND_TARGET).write_text("<html>mirrored</html>")
+    cdn.files[INDEX_URL] = "<html>v2</html>"
+    cdn.delay = 0.5
+    monkeypatch.setattr(frontend, "INDEX_FETCH_LATENCY_BUDGET", 0.05)
+
+    async def get_then_finish_fetch():
+        started = time.monotonic()
+        cached_index = await frontend.get_index(FRONTEND_TARGET)
+        elapsed = time.monotonic() - started
+        await asyncio.gather(*frontend._inflight_fetches.values())
+        return cached_index, elapsed
+
+    cached_index, elapsed = async_to_sync(get_then_finish_fetch)()
+
+    assert cached_index.html == "<html>mirrored</html>"
+    assert elapsed < cdn.delay
+    assert frontend.get_mirror_path(FRONTEND_TARGET).read_text() == "<html>v2</html>"
+    assert frontend.local_index_cache.get(FRONTEND_TARGET.cache_key).html == "<html>v2</html>"
+
+
+def test_get_index_skips_refresh_while_another_worker_holds_the_lock(cdn, locmem_cache):
+    cdn.files[INDEX_URL] = "<html>new</html>"
+    cache.set(
+        FRONTEND_TARGET.cache_key,
+        frontend.CachedIndex(html="<html>old</html>", fresh_until=time.time() - 1),
+        version=frontend.INDEX_CACHE_VERSION,
+    )
+    cache.add(
+        f"{FRONTEND_TARGET.cache_key}_refresh_lock",
+        1,
+        version=frontend.INDEX_CACHE_VERSION,
+    )
+
+    async def get_and_wait_for_refresh():
+        cached_index = await frontend.get_index(FRONTEND_TARGET)
+        await asyncio.gather(*frontend._background_refreshes)
+        return cached_index
+
+    assert async_to_sync(get_and_wait_for_refresh)().html == "<html>old</html>"
+    assert cdn.requests == []
+
+
+VITE_INDEX_HTML = (
+    """\
+<!doctype html>
+<html lang="en">
+  <head>
+    <meta charset="UTF-8" />
+    <link rel="icon" type="image/svg+xml" href="/vite.svg" />
+    <link rel="icon" href="/favicon.ico" sizes="any" />
+    <link rel="apple-touch-icon" href="/images/apple-touch-icon.png" />
+    <link rel="manifest" href="/site.webmanifest" />
+    <meta name="viewport" content="width=device-width, initial-scale=1.0" />
+    <title>App</title>
+    <script type="module" crossorigin src="/assets/index-DiwrgTda.js"></script>
+"""
+    + "".join(
+        f'    <link rel="modulepreload" crossorigin href="/assets/vendor-{index}-B1c2D3e4.js">\n'
+        for index in range(12)
+    )
+    + """\
+    <link rel="stylesheet" crossorigin href="/assets/index-C8sT1x9Q.css">
+  </head>
+  <body>
+    <div id="root"></div>
+    <a href="/settings/">Settings</a>
+  </body>
+</html>
+"""
+)
+
+
+def _rewrite_root_asset_urls_with_str_replace(html, *, cdn_domain, frontend_folder):
+    """The original 12-pass implementation, kept as a reference."""
+    base_url = f"https://{cdn_domain}/{frontend_folder}" if frontend_folder else f"https://{cdn_domain}"
+    for attribute in ("href", "src"):
+        for prefix in frontend.ROOT_ASSET_URL_PREFIXES:
+            html = html.replace(f'{attribute}="/{prefix}', f'{attribute}="{base_url}/{prefix}')
+    return html
+
+
+@pytest.mark.parametrize("frontend_folder", ["", "sites/app"])
+def test_rewrite_root_asset_urls_matches_reference_implementation(frontend_folder):
+    rewritten_html = frontend.rewrite_root_asset_urls(
+        VITE_INDEX_HTML, cdn_domain="cdn.example.com", frontend_folder=frontend_folder
+    )
+
+    assert rewritten_html == _rewrite_root_asset_urls_with_str_replace(
+        VITE_INDEX_HTML, cdn_domain="cdn.example.com", frontend_folder=frontend_folder
+    )
+    assert 'href="/settings/"' in rewritten_html
+    assert 'href="/' + "assets/" not in rewritten_html
+
+
+def test_get_preload_links_lists_vite_entry_bundles():
+    rewritten_html = frontend.rewrite_root_asset_urls(
+        VITE_INDEX_HTML, cdn_domain="cdn.example.com", frontend_folder=""
+    )
+
+    preload_links = frontend.get_preload_links(rewritten_html)
+
+    assert preload_links[0] == (
+        "<https://cdn.example.com/assets/index-DiwrgTda.js>; rel=modulepreload; crossorigin"
+    )
+    assert preload_links[-1] == (
+        "<https://cdn.example.com/assets/index-C8sT1x9Q.css>; rel=preload; as=style; crossorigin"
+    )
+    assert len(preload_links) == 14
+
+
+@override_settings(
+    ROOT_URLCONF="sites.tests",
+    ALLOWED_HOSTS=["app.example.com"],
+    SITE_ID=None,
+)
+def test_serve_index_emits_preload_link_header_and_records_early_hints(
+    client, cdn, locmem_cache, frontend_site
+):
+    cdn.files["https://cdn.example.com/sites/app/index.html"] = VITE_INDEX_HTML
+
+    response = client.get("/", HTTP_HOST=frontend_site.domain)
+
+    assert response["Link"].startswith(
+        "<https://cdn.example.com/sites/app/assets/index-DiwrgTda.js>; rel=modulepreload"
+    )
+    assert early_hint_links.get(frontend_site.domain)[0] in response["Link"]
+
+
+@override_settings(
+    ROOT_URLCONF="sites.tests",
+    ALLOWED_HOSTS=["app.example.com"],
+    SITE_ID=None,
+    USE_X_FORWARDED_HOST=True,
+)
+def test_early_hints_are_keyed_by_the_host_django_sees(
+    client, cdn, locmem_cache, frontend_site
+):
+    cdn.files["https://cdn.example.com/sites/app/index.html"] = VITE_INDEX_HTML
+    client.get("/", HTTP_HOST="proxy.internal", HTTP_X_FORWARDED_HOST="App.Example.com")
+    sent_messages = []
+
+    async def app(scope, receive, send):
+        pass
+
+    async def send(message):
+        sent_messages.append(message)
+
+    scope = {
+        "type": "http",
+        "path": "/",
+        "headers": [
+            (b"host", b"proxy.internal"),
+            (b"x-forwarded-host", b"app.example.com:443"),
+        ],
+        "extensions": {"http.response.early_hint": {}},
+    }
+    async_to_sync(EarlyHintsMiddleware(app))(scope, None, send)
+
+    assert sent_messages[0]["type"] == "http.response.early_hint"
+
+
+@override_settings(ROOT_URLCONF="sites.tests")
+def test_early_hints_middleware_sends_links_before_the_response():
+    early_hint_links.set("app.example.com", ("</assets/index.js>; rel=modulepreload",))
+    sent_messages = []
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    async def send(message):
+        sent_messages.append(message)
+
+    scope = {
+        "type": "http",
+        "path": "/",
+        "headers": [(b"host", b"app.example.com")],
+        "extensions": {"http.response.early_hint": {}},
+    }
+    async_to_sync(EarlyHintsMiddleware(app))(scope, None, send)
+
+    assert sent_messages[0] == {
+        "type": "http.response.early_hint",
+        "links": [b"</assets/index.js>; rel=modulepreload"],
+    }
+    assert sent_messages[1]["type"] == "http.response.start"
+
+
+@pytest.mark.exploratory
+def test_benchmark_rewrite_root_asset_urls():
+    rewrite_kwargs = {"cdn_domain": "d111111abcdef8.cloudfront.net", "frontend_folder": "sites/app"}
+    number = 20000
+
+    def rewrite_cold():
+        frontend._rewritten_html_cache.clear()
+        frontend.rewrite_root_asset_urls(VITE_INDEX_HTML, **rewrite_kwargs)
+
+    str_replace_seconds = timeit.timeit(
+        lambda: _rewrite_root_asset_urls_with_str_replace(VITE_INDEX_HTML, **rewrite_kwargs),
+        number=number,
+    )
+    single_pass_seconds = timeit.timeit(rewrite_cold, number=number)
+    memoized_seconds = timeit.timeit(
+        lambda: frontend.rewrite_root_asset_urls(VITE_INDEX_HTML, **rewrite_kwargs),
+        number=number,
+    )
+
+    print(f"str.replace x12:  {str_replace_seconds / number * 1e6:.2f} us/call")
+    print(f"single pass:      {single_pass_seconds / number * 1e6:.2f} us/call")
+    print(f"memoized:         {memoized_seconds / number * 1e6:.2f} us/call")
+
+
+def test_sync_deployment_site_invalidates_and_prewarms_index(
+    cdn, locmem_cache, published_invalidations
+):
+    site = Site.objects.create(domain="deploy-abc.openbase.app", name="deploy-abc.openbase.app")
+    SiteAttributes.objects.create(
+        site=site,
+        s3_custom_domain="old.cloudfront.net",
+        s3_frontend_folder="sites/old",
+    )
+    old_target = frontend.get_frontend_target(site.attributes)
+    cache.set(old_target.cache_key, "old", version=frontend.INDEX_CACHE_VERSION)
+    frontend.local_index_cache.set(old_target.cache_key, "old")
+    snapshot = site_utils.get_site_snapshot()
+    cdn.files["https://new.cloudfront.net/sites/new/index.html"] = "<html>new</html>"
+
+    call_command(
+        "sync_deployment_site",
+        "--domain",
+        "deploy-abc.openbase.app",
+        "--s3-custom-domain",
+        "new.cloudfront.net",
+        "--s3-frontend-folder",
+        "sites/new",
+        "--prewarm",
+    )
+
+    new_target = frontend.get_frontend_target(SiteAttributes.objects.get(site=site))
+    prewarmed_index = cache.get(new_target.cache_key, version=frontend.INDEX_CACHE_VERSION)
+
+    assert cache.get(old_target.cache_key, version=frontend.INDEX_CACHE_VERSION) is None
+    assert frontend.local_index_cache.get(old_target.cache_key) is None
+    assert site_utils.get_site_snapshot() is not snapshot
+    assert prewarmed_index.html == "<html>new</html>"
+    assert published_invalidations == [
+        (
+            site_invalidation.SITE_INVALIDATION_CHANNEL,
+            {"index_cache_keys": sorted([old_target.cache_key, new_target.cache_key])},
+        )
+    ]
+
+
+def test_sync_deployment_site_fails_when_prewarm_fetch_fails(
+    cdn, locmem_cache, published_invalidations
+):
+    with pytest.raises(CommandError, match="Failed to prewarm"):
+        call_command(
+            "sync_deployment_site",
+            "--domain",
+            "deploy-abc.openbase.app",
+            "--s3-custom-domain",
+            "missing.cloudfront.net",
+            "--prewarm",
+        )
+
+    assert published_invalidations == []
+
+
 class _AdminTestUser:
     is_active = True
     is_staff = True
@@ -223,3 +1028,72 @@ class _AdminTestUser:
 
     def has_perm(self, perm, obj=None):
         return True
+
+
+@pytest.mark.exploratory
+@override_settings(ALLOWED_HOSTS=["*"], SITE_ID=None)
+def test_benchmark_async_site_resolution_thread_hops(rf, thread_hops):
+    hosts = [f"site-{index}.example.com" for index in range(10)]
+    for host in hosts:
+        SiteAttributes.objects.create(site=Site.objects.create(domain=host, name=host))
+    requests = [rf.get("/", HTTP_HOST=hosts[index % len(hosts)]) for index in range(1000)]
+
+    async def resolve_with_sync_to_async_lookup():
+        # The resolver this replaced: a threaded get_current_site plus an
+        # attributes query on every local cache miss.
+        attributes_by_host = {}
+        for request in requests:
+            host = request.get_host()
+            if host not in attributes_by_host:
+                site = await sync_to_async(get_current_site)(request)
+                attributes_by_host[host] = await SiteAttributes.objects.filter(
+                    site=site
+                ).afirst()
+
+    async def resolve_with_snapshot():
+        for request in requests:
+            await site_utils.aget_current_site_attributes(request)
+
+    for name, resolve in [
+        ("sync_to_async lookup", resolve_with_sync_to_async_lookup),
+        ("snapshot", resolve_with_snapshot),
+    ]:
+        Site.objects.clear_cache()
+        site_utils.clear_site_snapshot()
+        thread_hops["sync_to_async"] = 0
+        started = time.perf_counter()
+        async_to_sync(resolve)()
+        elapsed = time.perf_counter() - started
+        print(
+            f"{name:22} {thread_hops['sync_to_async'] / len(requests):.3f} hops/request, "
+            f"{elapsed / len(requests) * 1e6:.2f} us/request"
+        )
+
+
+@pytest.mark.exploratory
+@override_settings(
+    ROOT_URLCONF="sites.tests",
+    ALLOWED_HOSTS=["admin.example.com"],
+    SITE_ID=None,
+)
+def test_benchmark_get_app_list_for_restricted_site(rf):
+    site = Site.objects.create(domain="admin.example.com", name="Admin Example")
+    SiteAttributes.objects.create(site=site, admin_app_labels=["users"])
+    request = rf.get("/admin/", HTTP_HOST=site.domain)
+    request.user = _AdminTestUser()
+    allowed_app_labels = site_utils.get_site_entry(request).admin_app_labels
+    number = 2000
+
+    def build_then_filter():
+        # The previous approach: build every app, then discard most of them.
+        app_list = admin.AdminSite.get_app_list(dynamic_admin_site, request)
+        return [app for app in app_list if app["app_label"] in allowed_app_labels]
+
+    assert build_then_filter() == dynamic_admin_site.get_app_list(request)
+    build_then_filter_seconds = timeit.timeit(build_then_filter, number=number)
+    filter_first_seconds = timeit.timeit(
+        lambda: dynamic_admin_site.get_app_list(request), number=number
+    )
+
+    print(f"build then filter: {build_then_filter_seconds / number * 1e6:.2f} us/call")
+    print(f"filter first:      {filter_first_seconds / number * 1e6:.2f} us/call")
@@ -1,60 +1,220 @@
+import asyncio
+import os
+import time
+from collections.abc import Mapping  # noqa: TC003
+from types import MappingProxyType
+from typing import NamedTuple
+
 from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.sites.models import Site
-from django.contrib.sites.shortcuts import get_current_site
+from django.db import DEFAULT_DB_ALIAS, close_old_connections
+from django.http.request import split_domain_port
 
-from .models import SiteAttributes
+from .models import SiteAttributes  # noqa: TC001
 
-# Local memory cache mapping hosts to site attributes
-_site_attributes_cache = {}
+# Backstop for invalidations missed while Redis pub/sub was unavailable.
+SITE_SNAPSHOT_TTL = float(os.environ.get("SITE_SNAPSHOT_TTL", "300"))
 
 
-def get_current_site_attributes(request) -> SiteAttributes | None:
+class SiteEntry(NamedTuple):
+    site: Site
+    attributes: SiteAttributes | None
+    # Normalized SiteAttributes.admin_app_labels; None leaves the admin
+    # unrestricted.
+    admin_app_labels: frozenset[str] | None = None
+
+
+class SiteSnapshot(NamedTuple):
+    by_id: Mapping[int, SiteEntry]
+    by_domain: Mapping[str, SiteEntry]
+    expires_at: float
+
+    def is_expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def resolve(self, request) -> SiteEntry | None:
+        """
+        Resolve the request's site the way django.contrib.sites does: SITE_ID
+        if set, otherwise the host, then the host without its port.
+        """
+        site_id = getattr(settings, "SITE_ID", None)
+        if site_id:
+            return self.by_id.get(site_id)
+        host = request.get_host().lower()
+        entry = self.by_domain.get(host)
+        if entry is None:
+            domain, _port = split_domain_port(host)
+            entry = self.by_domain.get(domain)
+        return entry
+
+
+class SiteSnapshotStats(NamedTuple):
+    sites: int
+    hits: int
+    misses: int
+    # Lookups of hosts that are not a known site, such as scanners' Host headers.
+    unresolved: int
+    # Wall-clock time of the last load, or None before the first one.
+    loaded_at: float | None
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+# Every site with its attributes, loaded in one query and replaced as a whole.
+# Site and SiteAttributes changes drop it (see sites.invalidation); it is loaded
+# at startup by the ASGI lifespan and otherwise on first use or after its TTL.
+# The generation stops a load that raced with an invalidation from storing
+# stale data.
+_site_snapshot: SiteSnapshot | None = None
+_site_snapshot_generation = 0
+# In-flight async loads keyed by generation, so concurrent lookups share one
+# query and a load started before an invalidation is never reused after it.
+_site_snapshot_loads: dict[int, asyncio.Task] = {}
+# Snapshot lookups served from memory (hits) or that had to load it (misses).
+_site_snapshot_counts = {"hits": 0, "misses": 0, "unresolved": 0}
+_site_snapshot_loaded_at: float | None = None
+
+
+def _site_snapshot_queryset():
+    # Loads follow invalidations, so read the primary rather than a replica
+    # that may not have the change yet.
+    return (
+        Site.objects.using(DEFAULT_DB_ALIAS).select_related("attributes").order_by("pk")
+    )
+
+
+def _store_site_snapshot(sites, generation: int) -> SiteSnapshot:
+    global _site_snapshot, _site_snapshot_loaded_at  # noqa: PLW0603
+    entries = []
+    for site in sites:
+        # A missing reverse one-to-one raises an AttributeError subclass.
+        attributes = getattr(site, "attributes", None)
+        admin_app_labels = None
+        if attributes is not None and attributes.admin_app_labels:
+            admin_app_labels = frozenset(
+                app_label.strip()
+                for app_label in attributes.admin_app_labels
+                if isinstance(app_label, str) and app_label.strip()
+            )
+        entries.append(SiteEntry(site, attributes, admin_app_labels))
+    snapshot = SiteSnapshot(
+        by_id=MappingProxyType({entry.site.pk: entry for entry in entries}),
+        by_domain=MappingProxyType(
+            {entry.site.domain.lower(): entry for entry in entries}
+        ),
+        expires_at=time.monotonic() + SITE_SNAPSHOT_TTL,
+    )
+    if generation == _site_snapshot_generation:
+        _site_snapshot = snapshot
+        _site_snapshot_loaded_at = time.time()
+    return snapshot
+
+
+def get_site_snapshot() -> SiteSnapshot:
+    snapshot = _site_snapshot
+    if snapshot is None or snapshot.is_expired():
+        _site_snapshot_counts["misses"] += 1
+        generation = _site_snapshot_generation
+        snapshot = _store_site_snapshot(list(_site_snapshot_queryset()), generation)
+    else:
+        _site_snapshot_counts["hits"] += 1
+    return snapshot
+
+
+def _load_sites_and_release_connection() -> list[Site]:
+    # Async loads may outlive the request that started them, and then nothing
+    # returns their connection to the pool. Release it in the thread that
+    # used it, as config.db.arelease_database_connections does.
+    try:
+        return list(_site_snapshot_queryset())
+    finally:
+        close_old_connections()
+
+
+async def _aload_site_snapshot(generation: int) -> SiteSnapshot:
+    sites = await sync_to_async(_load_sites_and_release_connection)()
+    return _store_site_snapshot(sites, generation)
+
+
+def _site_snapshot_load_task() -> asyncio.Task:
+    loop = asyncio.get_running_loop()
+    generation = _site_snapshot_generation
+    task = _site_snapshot_loads.get(generation)
+    if task is None or task.done() or task.get_loop() is not loop:
+        task = loop.create_task(_aload_site_snapshot(generation))
+        _site_snapshot_loads[generation] = task
+
+        def forget_load(done):
+            if _site_snapshot_loads.get(generation) is done:
+                del _site_snapshot_loads[generation]
+
+        task.add_done_callback(forget_load)
+    return task
+
+
+async def aget_site_snapshot() -> SiteSnapshot:
     """
-    Get the attributes for the current site, using a local memory cache.
+    Only a missing snapshot is awaited. An expired one keeps being served while
+    it reloads in the background, so site lookups stay on the event loop.
     """
-    host = request.get_host()
+    snapshot = _site_snapshot
+    if snapshot is None:
+        _site_snapshot_counts["misses"] += 1
+        return await asyncio.shield(_site_snapshot_load_task())
+    _site_snapshot_counts["hits"] += 1
+    if snapshot.is_expired():
+        _site_snapshot_load_task()
+    return snapshot
 
-    # Check cache first
-    if host in _site_attributes_cache:
-        return _site_attributes_cache[host]
 
-    # Get site and its attributes
-    site = get_current_site(request)
-    if not isinstance(
-        site, Site
-    ):  # Skip caching for RequestSite objects (used in tests)
-        return None
+def clear_site_snapshot() -> None:
+    global _site_snapshot, _site_snapshot_generation  # noqa: PLW0603
+    _site_snapshot_generation += 1
+    _site_snapshot = None
 
-    try:
-        attributes = SiteAttributes.objects.get(site=site)
-        _site_attributes_cache[host] = attributes
-        return attributes
-    except SiteAttributes.DoesNotExist:
-        _site_attributes_cache[host] = None
-        return None
 
+def get_site_snapshot_stats() -> SiteSnapshotStats:
+    snapshot = _site_snapshot
+    return SiteSnapshotStats(
+        sites=len(snapshot.by_id) if snapshot is not None else 0,
+        loaded_at=_site_snapshot_loaded_at,
+        **_site_snapshot_counts,
+    )
 
-async def aget_current_site_attributes(request) -> SiteAttributes | None:
+
+def _count_unresolved(entry: SiteEntry | None) -> SiteEntry | None:
+    if entry is None:
+        _site_snapshot_counts["unresolved"] += 1
+    return entry
+
+
+def get_site_entry(request) -> SiteEntry | None:
     """
-    Async version of get_current_site_attributes.
+    Get the site and attributes for the request. Resolved once per request,
+    normally by config.middlewares.site_snapshot_middleware.
     """
-    host = request.get_host()
+    if not hasattr(request, "site_entry"):
+        request.site_entry = _count_unresolved(get_site_snapshot().resolve(request))
+    return request.site_entry
 
-    # Check cache first
-    if host in _site_attributes_cache:
-        return _site_attributes_cache[host]
 
-    # Get site and its attributes
-    site = await sync_to_async(get_current_site)(request)
-    if not isinstance(
-        site, Site
-    ):  # Skip caching for RequestSite objects (used in tests)
-        return None
+async def aget_site_entry(request) -> SiteEntry | None:
+    if not hasattr(request, "site_entry"):
+        request.site_entry = _count_unresolved(
+            (await aget_site_snapshot()).resolve(request)
+        )
+    return request.site_entry
 
-    try:
-        attributes = await SiteAttributes.objects.aget(site=site)
-        _site_attributes_cache[host] = attributes
-        return attributes
-    except SiteAttributes.DoesNotExist:
-        _site_attributes_cache[host] = None
-        return None
+
+def get_current_site_attributes(request) -> SiteAttributes | None:
+    entry = get_site_entry(request)
+    return entry.attributes if entry is not None else None
+
+
+async def aget_current_site_attributes(request) -> SiteAttributes | None:
+    entry = await aget_site_entry(request)
+    return entry.attributes if entry is not None else None
@@ -1,27 +1,28 @@
 import httpx
-from django.conf import settings
-from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
 from django.http import JsonResponse
 from django.http import HttpResponse
 from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_vary_headers
 
+from .early_hints import early_hint_links, early_hints_host
+from .frontend import get_frontend_target, get_index
 from .utils import aget_current_site_attributes
 
 
-def rewrite_root_asset_urls(html: str, *, cdn_domain: str, frontend_folder: str) -> str:
-    base_url = f"https://{cdn_domain}/{frontend_folder}" if frontend_folder else f"https://{cdn_domain}"
-    asset_prefixes = (
-        "assets/",
-        "images/",
-        "favicon",
-        "manifest",
-        "site.webmanifest",
-        "vite.svg",
-    )
-    for attribute in ("href", "src"):
-        for prefix in asset_prefixes:
-            html = html.replace(f'{attribute}="/{prefix}', f'{attribute}="{base_url}/{prefix}')
-    return html
+def _index_fetch_error_response(error: httpx.HTTPError) -> HttpResponse:
+    if isinstance(error, httpx.HTTPStatusError):
+        return HttpResponse(
+            f"Error fetching index.html from S3: {error}",
+            status=error.response.status_code,
+        )
+    if isinstance(error, httpx.TimeoutException):
+        return HttpResponse(
+            f"Timed out fetching index.html from S3: {error}",
+            status=504,
+        )
+    # The CDN could not be reached, or the transfer failed.
+    return HttpResponse(f"Could not fetch index.html from S3: {error}", status=502)
 
 
 async def serve_index(request, resource):
@@ -33,49 +34,31 @@ async def serve_index(request, resource):
     if not site_attributes:
         return HttpResponse("Site not found.", status=404)
 
-    site_s3_folder = site_attributes.s3_frontend_folder.strip().strip("/")
-    site_s3_domain = site_attributes.s3_custom_domain.strip()
-    if site_s3_folder and not site_s3_domain:
-        return HttpResponse(
-            "Deployment site is missing a public asset domain. Run deployment site sync again.",
-            status=500,
-        )
-    if not site_s3_domain:
-        site_s3_domain = settings.AWS_S3_CUSTOM_DOMAIN.strip()
-    cache_key = f"index_html_cache_{site_s3_domain}_{site_s3_folder}"
-    cache_timeout = 10  # Cache timeout in seconds
-
-    # Attempt to get the cached content asynchronously
-    cached_content = await cache.aget(cache_key)
-    if cached_content:
-        response = HttpResponse(cached_content, content_type="text/html")
-    else:
-        # Fetch the content using httpx
-        async with httpx.AsyncClient() as client:
-            try:
-                frontend_path = f"{site_s3_folder}/index.html" if site_s3_folder else "index.html"
-                url = f"https://{site_s3_domain}/{frontend_path}"
-                response = await client.get(url)
-                response.raise_for_status()
-                file_contents = rewrite_root_asset_urls(
-                    response.text,
-                    cdn_domain=site_s3_domain,
-                    frontend_folder=site_s3_folder,
-                )
+    try:
+        target = get_frontend_target(site_attributes)
+    except ImproperlyConfigured as e:
+        return HttpResponse(str(e), status=500)
 
-                # Cache the fetched content asynchronously
-                await cache.aset(cache_key, file_contents, cache_timeout)
-
-                response = HttpResponse(file_contents, content_type="text/html")
-            except httpx.HTTPStatusError as e:
-                return HttpResponse(
-                    f"Error fetching index.html from S3: {e}",
-                    status=e.response.status_code,
-                )
+    try:
+        cached_index = await get_index(target)
+    except httpx.HTTPError as e:
+        return _index_fetch_error_response(e)
+    variant = cached_index.variant(request.headers.get("Accept-Encoding", ""))
+    response = HttpResponse(variant.content, content_type="text/html")
+    if variant.content_encoding:
+        response["Content-Encoding"] = variant.content_encoding
+    response["ETag"] = variant.etag
+    patch_vary_headers(response, ("Accept-Encoding",))
+    if cached_index.preload_links:
+        response["Link"] = ", ".join(cached_index.preload_links)
+        early_hint_links.set(
+            early_hints_host(request.get_host()), cached_index.preload_links
+        )
 
     # Manually ensure a CSRF token is generated and set the CSRF cookie
     get_token(request)
-    return response
+    # Answer If-None-Match with a 304 when the browser already has this shell
+    return get_conditional_response(request, etag=variant.etag, response=response)
 
 
 def csrf_token(request):
@@ -1,6 +1,6 @@
-import contextlib
-
+import redis
 import stripe
+import structlog
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import (
@@ -8,15 +8,36 @@ from django.contrib.auth.models import (
     BaseUserManager,
     PermissionsMixin,
 )
-from django.db import models
+from django.db import models, router, transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
 from rest_framework.authtoken.models import Token
+from taskiq.exceptions import SendTaskError
+
+logger = structlog.get_logger(__name__)
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
 
+def enqueue_stripe_customer_creation(account_id: int) -> None:
+    """
+    Create the account's Stripe customer in the background. If this fails the
+    customer is created at first payment instead.
+    """
+    from config.taskiq_config import enqueue_task
+    from users.tasks import create_stripe_customer
+
+    try:
+        enqueue_task(create_stripe_customer, account_id)
+    except (SendTaskError, redis.RedisError, OSError):
+        logger.warning(
+            "Could not enqueue Stripe customer creation",
+            account_id=account_id,
+            exc_info=True,
+        )
+
+
 class UserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
         """
@@ -70,42 +91,42 @@ class User(AbstractBaseUser, PermissionsMixin):
     )
 
     def get_account(self):
-        if not hasattr(self, "account") or self.account is None:
-            from payment.models import Account
-
-            account = Account.objects.create(user_owner=self)
-        else:
-            account = self.account
-        if not account.customer_id:
-            with contextlib.suppress(stripe.error.AuthenticationError):
-                customer = stripe.Customer.create(
-                    email=self.email,
-                    metadata={"user_id": self.id},
-                )
-                customer_id = customer.id
-                account.customer_id = customer_id
-                account.save()
+        """
+        The user's account. It is created with the user; its Stripe customer is
+        created later (see payment.billing.ensure_stripe_customer).
+        """
+        if hasattr(self, "account") and self.account is not None:
+            return self.account
+        from payment.models import Account
+
+        # Users created before accounts were created with them.
+        account, _created = Account.objects.get_or_create(user_owner=self)
         return account
 
     async def aget_account(self):
         from payment.models import Account
 
-        account = await Account.objects.filter(user_owner=self).afirst()
-        if account is None:
-            account = await Account.objects.acreate(user_owner=self)
-        if not account.customer_id:
-            customer = await stripe.Customer.create_async(
-                email=self.email,
-                metadata={"user_id": self.id},
-            )
-            customer_id = customer.id
-            account.customer_id = customer_id
-            await account.asave()
+        account, _created = await Account.objects.aget_or_create(user_owner=self)
         return account
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.get_account()
+        if not self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        from payment.models import Account
+
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            # get_or_create, as an unsaved instance may still point at a
+            # user that already has an account.
+            account, created = Account.objects.db_manager(
+                self._state.db
+            ).get_or_create(user_owner=self)
+        if created:
+            transaction.on_commit(
+                lambda: enqueue_stripe_customer_creation(account.pk), using=using
+            )
 
     objects = UserManager()
 
@@ -130,13 +151,10 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     async def active_subscription(self):
         """Returns the subscription type if there's an active subscription, None otherwise"""
-        from payment.models import Subscription  # Move import here
+        from payment.entitlements import aget_entitlement
 
-        account = await self.aget_account()
-        subscription = await Subscription.objects.filter(account=account).afirst()
-        if subscription and subscription.is_active():
-            return subscription.subscription_type
-        return None
+        entitlement = await aget_entitlement(self.pk)
+        return entitlement.active_subscription
 
 
 @receiver(post_save, sender=get_user_model())
@@ -1,14 +1,20 @@
-from asgiref.sync import async_to_sync
 from django.contrib.auth import get_user_model
 from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 
 from config.serializers import BaseModelSerializer
+from payment.entitlements import Entitlement, get_entitlement
 
 User = get_user_model()
 
 
 class UserSerializer(BaseModelSerializer):
+    """
+    Balance and subscription come from the user's cached entitlement. Pass it
+    in the context as "entitlement", as users.views.UserDetail does, so
+    serializing runs no queries or cache calls.
+    """
+
     class Meta:
         model = User
         fields = [
@@ -25,10 +31,16 @@ class UserSerializer(BaseModelSerializer):
     balance = serializers.SerializerMethodField()
     active_subscription = serializers.SerializerMethodField()
 
+    def _get_entitlement(self, obj) -> Entitlement:
+        entitlement = self.context.get("entitlement")
+        if entitlement is None:
+            entitlement = get_entitlement(obj.pk)
+        return entitlement
+
     @extend_schema_field(serializers.DecimalField(max_digits=10, decimal_places=2))
     def get_balance(self, obj):
-        return obj.get_account().balance
+        return self._get_entitlement(obj).balance
 
     @extend_schema_field(serializers.BooleanField)
     def get_active_subscription(self, obj):
-        return async_to_sync(obj.active_subscription)()
+        return self._get_entitlement(obj).active_subscription
@@ -10,6 +10,8 @@ from twilio.rest import Client
 
 from config.email import get_site_from_email
 from config.taskiq_config import broker
+from payment.billing import ensure_stripe_customer
+from payment.models import Account
 from users.models import UserAPNSToken
 
 required_prefix = "From your assistant: "
@@ -33,6 +35,16 @@ def send_email(subject, message, to_email, site_id=None):
     email_message.send()
 
 
+@broker.task
+def create_stripe_customer(account_id):
+    # Idempotent: a no-op once the account has a customer, and concurrent runs
+    # share one Stripe idempotency key.
+    account = Account.objects.select_related("user_owner", "team_owner").get(
+        pk=account_id
+    )
+    ensure_stripe_customer(account)
+
+
 @broker.task
 def send_sms(message, to_number):
     client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
@@ -0,0 +1,144 @@
+from types import SimpleNamespace
+
+import pytest
+import stripe
+from django.contrib.auth import get_user_model
+from rest_framework.authtoken.models import Token
+from taskiq.exceptions import SendTaskError
+
+from config import taskiq_config
+from config.queries import assert_query_budget
+from payment.billing import ensure_stripe_customer
+from payment.models import Account
+from users.tasks import create_stripe_customer
+
+pytestmark = pytest.mark.django_db
+
+
+class FakeCustomer:
+    def __init__(self, customer_id):
+        self.id = customer_id
+
+
+@pytest.fixture
+def stripe_customers(monkeypatch):
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return FakeCustomer("cus_123")
+
+    monkeypatch.setattr(stripe.Customer, "create", create)
+    return calls
+
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        taskiq_config, "enqueue_task", lambda task, *args: calls.append((task, args))
+    )
+    return calls
+
+
+def test_creating_a_user_creates_its_account_and_defers_the_stripe_customer(
+    stripe_customers, enqueued, django_capture_on_commit_callbacks
+):
+    with django_capture_on_commit_callbacks(execute=True):
+        user = get_user_model().objects.create_user(email="new@example.com")
+
+    account = Account.objects.get(user_owner=user)
+    assert account.customer_id == ""
+    assert Token.objects.filter(user=user).exists()
+    assert stripe_customers == []
+    assert enqueued == [(create_stripe_customer, (account.pk,))]
+
+
+def test_saving_an_existing_user_has_no_side_effects(stripe_customers, enqueued):
+    user = get_user_model().objects.create_user(email="new@example.com")
+    user = get_user_model().objects.get(pk=user.pk)
+
+    with assert_query_budget(1):
+        user.first_name = "Ada"
+        user.save()
+
+    assert stripe_customers == []
+
+
+def test_stripe_customer_task_is_idempotent(stripe_customers):
+    user = get_user_model().objects.create_user(email="new@example.com")
+    account = user.get_account()
+
+    create_stripe_customer(account.pk)
+    create_stripe_customer(account.pk)
+
+    account.refresh_from_db()
+    assert account.customer_id == "cus_123"
+    assert len(stripe_customers) == 1
+    assert stripe_customers[0]["email"] == "new@example.com"
+    assert stripe_customers[0]["idempotency_key"] == (
+        f"account-{account.pk}-stripe-customer"
+    )
+    assert ensure_stripe_customer(account) == "cus_123"
+    assert len(stripe_customers) == 1
+
+
+def test_user_creation_survives_an_unreachable_broker(
+    monkeypatch, django_capture_on_commit_callbacks
+):
+    def enqueue_task(task, *args):
+        raise SendTaskError
+
+    monkeypatch.setattr(taskiq_config, "enqueue_task", enqueue_task)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        user = get_user_model().objects.create_user(email="new@example.com")
+
+    assert Account.objects.filter(user_owner=user).exists()
+
+
+def test_saving_an_unsaved_copy_of_a_user_keeps_its_account(enqueued):
+    user = get_user_model().objects.create_user(email="new@example.com")
+    account = user.get_account()
+
+    get_user_model()(pk=user.pk, email=user.email, password=user.password).save()
+
+    assert list(Account.objects.filter(user_owner=user)) == [account]
+
+
+def test_add_value_answers_bad_gateway_when_stripe_is_unavailable(client, monkeypatch):
+    def create(**kwargs):
+        msg = "Invalid API key"
+        raise stripe.error.AuthenticationError(msg)
+
+    monkeypatch.setattr(stripe.Customer, "create", create)
+    client.force_login(get_user_model().objects.create_user(email="new@example.com"))
+
+    response = client.post(
+        "/api/add-value/",
+        {"payment_method_id": "pm_123", "amount": "10.00"},
+        content_type="application/json",
+    )
+
+    assert response.status_code == 502
+    assert response.json() == {"error": "Payment could not be processed"}
+
+
+def test_customer_portal_creates_the_stripe_customer_on_first_use(
+    client, monkeypatch, stripe_customers
+):
+    monkeypatch.setattr(
+        stripe.billing_portal.Session,
+        "create",
+        lambda **kwargs: SimpleNamespace(
+            url=f"https://billing.example.com/{kwargs['customer']}"
+        ),
+    )
+    user = get_user_model().objects.create_user(email="new@example.com")
+    client.force_login(user)
+
+    response = client.post("/api/customer-portal/", {}, content_type="application/json")
+
+    assert response.status_code == 200
+    assert response.json() == {"url": "https://billing.example.com/cus_123"}
+    assert Account.objects.get(user_owner=user).customer_id == "cus_123"
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIHandler
+from django.test import override_settings
+from django.urls import include, path
+from rest_framework import generics
+
+from config import queries as config_queries
+from config.testing import call_asgi
+from users import serializers
+from users import views as users_views
+from users.models import UserAPNSToken
+
+# Simulated slow I/O per request for the load test.
+LATENCY = 0.05
+
+
+class SyncUserDetail(generics.RetrieveAPIView):
+    """The previous sync UserDetail, as the load test baseline."""
+
+    serializer_class = serializers.UserSerializer
+
+    def get_object(self):
+        with waiting_on_io():
+            time.sleep(LATENCY)
+        return get_user_model().objects.get(pk=self.request.user.pk)
+
+
+urlpatterns = [
+    path("api/", include("users.urls")),
+    path("sync-me/", SyncUserDetail.as_view()),
+]
+
+load = {"waiting": 0, "peak_waiting": 0, "peak_threads": 0}
+
+
+@contextmanager
+def waiting_on_io():
+    load["waiting"] += 1
+    load["peak_waiting"] = max(load["peak_waiting"], load["waiting"])
+    load["peak_threads"] = max(load["peak_threads"], threading.active_count())
+    try:
+        yield
+    finally:
+        load["waiting"] -= 1
+
+
+@pytest.fixture
+def user(client):
+    user = get_user_model().objects.create_user(email="device@example.com")
+    client.force_login(user)
+    return user
+
+
+@pytest.mark.django_db
+def test_apns_view_registers_then_updates_the_device_token(client, user):
+    response = client.post("/api/apns/", {"token": "first"})
+    assert response.json() == {"message": "Device token registered successfully."}
+
+    response = client.post("/api/apns/", {"token": "second"})
+    assert response.json() == {"message": "Device token updated successfully."}
+    assert UserAPNSToken.objects.get(user=user).token == "second"
+
+    response = client.post("/api/apns/", {})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_delete_user_view_deletes_the_user_and_account(client, user):
+    response = client.post("/api/users/me/delete/", {"confirm": "yes"})
+
+    assert response.json() == {"message": "Account deleted successfully."}
+    assert not get_user_model().objects.filter(pk=user.pk).exists()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    ("method", "url"),
+    [
+        ("get", "/api/users/me/"),
+        ("post", "/api/apns/"),
+        ("post", "/api/users/me/delete/"),
+    ],
+)
+def test_async_user_views_require_authentication(client, method, url):
+    assert getattr(client, method)(url).status_code == 403
+
+
+@pytest.mark.exploratory
+@pytest.mark.django_db(transaction=True)
+@override_settings(ROOT_URLCONF=__name__)
+def test_load_async_user_detail_beyond_the_thread_pool(
+    client, user, locmem_cache, monkeypatch
+):
+    concurrency = 64
+    original_aget_entitlement = users_views.aget_entitlement
+
+    async def slow_aget_entitlement(user_id):
+        with waiting_on_io():
+            await asyncio.sleep(LATENCY)
+        return await original_aget_entitlement(user_id)
+
+    monkeypatch.setattr(users_views, "aget_entitlement", slow_aget_entitlement)
+    # SQLite queries slow down under this load; their aggregation needs Redis.
+    monkeypatch.setattr(config_queries, "SLOW_QUERY_MS", math.inf)
+    cookie = f"{settings.SESSION_COOKIE_NAME}={client.session.session_key}"
+    headers = [(b"cookie", cookie.encode())]
+    app = ASGIHandler()
+    logging.disable(logging.CRITICAL)
+    print(f"\n{concurrency} concurrent requests, {LATENCY * 1000:.0f} ms of I/O each")
+    peak_waiting = {}
+    for name, url in [("async", "/api/users/me/"), ("sync", "/sync-me/")]:
+
+        async def get_concurrently(url=url):
+            return await asyncio.gather(
+                *(call_asgi(app, "GET", url, headers) for _ in range(concurrency))
+            )
+
+        load.update(peak_waiting=0, peak_threads=0)
+        started = time.perf_counter()
+        # Not async_to_sync: under it, asgiref runs every thread-sensitive call
+        # in this thread, one at a time, instead of in per-request threads.
+        results = asyncio.run(get_concurrently())
+        elapsed = time.perf_counter() - started
+        assert {status for status, _headers in results} == {200}
+        # Sync requests wait in their own thread; async ones on the event loop,
+        # keeping a thread only for authentication and the query.
+        print(
+            f"{name:5} {elapsed:.2f}s, {concurrency / elapsed:.0f} requests/s, "
+            f"{load['peak_waiting']} waiting at once, "
+            f"{load['peak_threads']} threads alive"
+        )
+        peak_waiting[name] = load["peak_waiting"]
+    logging.disable(logging.NOTSET)
+
+    # Async requests wait on the event loop, so more of them wait at once
+    # than sync requests, which each hold a thread.
+    assert peak_waiting["async"] > peak_waiting["sync"]
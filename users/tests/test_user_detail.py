@@ -0,0 +1,48 @@
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+
+from config.queries import assert_query_budget
+from payment.entitlements import get_entitlement
+from users.serializers import UserSerializer
+
+pytestmark = pytest.mark.django_db
+
+
+def test_user_detail_reads_balance_and_subscription_from_the_entitlement(
+    client, locmem_cache, subscriber
+):
+    client.force_login(subscriber)
+
+    # The view's query_budget is enforced by query_budget_middleware in tests.
+    response = client.get("/api/users/me/")
+    with assert_query_budget(2):
+        cached_response = client.get("/api/users/me/")
+
+    assert response.status_code == 200
+    assert response.json()["balance"] == 12.5
+    assert response.json()["active_subscription"] == "pro"
+    assert cached_response.json() == response.json()
+
+
+def test_user_serializer_runs_no_queries_with_an_entitlement(locmem_cache, subscriber):
+    entitlement = get_entitlement(subscriber.pk)
+
+    with assert_query_budget(0):
+        data = UserSerializer(subscriber, context={"entitlement": entitlement}).data
+
+    assert data["email"] == "member@example.com"
+    assert data["active_subscription"] == "pro"
+
+
+def test_user_serializer_handles_users_without_an_account_or_subscription(
+    locmem_cache,
+):
+    user = get_user_model().objects.create_user(email="new@example.com")
+    user.account.delete()
+
+    data = UserSerializer(user).data
+
+    assert data["balance"] == Decimal(0)
+    assert data["active_subscription"] is None
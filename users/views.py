@@ -1,10 +1,14 @@
+from adrf import generics
+from adrf.views import APIView
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from drf_spectacular.utils import extend_schema, inline_serializer
-from rest_framework import generics, status
 from rest_framework import serializers as drf_serializers
+from rest_framework import status
 from rest_framework.response import Response
-from rest_framework.views import APIView
+
+from config.permissions import IsAuthenticated
+from payment.entitlements import aget_entitlement
 
 from . import serializers
 from .models import (
@@ -16,9 +20,22 @@ User = get_user_model()
 
 class UserDetail(generics.RetrieveAPIView):
     serializer_class = serializers.UserSerializer
+    permission_classes = [IsAuthenticated]
+    # Authentication (session and user) plus the entitlement on a cache miss.
+    query_budget = 3
 
-    def get_object(self):
-        return self.request.user
+    async def get(self, request, *args, **kwargs):
+        entitlement = await aget_entitlement(request.user.pk)
+        # The serializer only reads the user and the entitlement, so it runs on
+        # the event loop instead of in a thread per field.
+        serializer = self.get_serializer(
+            request.user,
+            context={
+                **self.get_serializer_context(),
+                "entitlement": entitlement,
+            },
+        )
+        return Response(serializer.data)
 
 
 class APNSView(APIView):
@@ -26,6 +43,8 @@ class APNSView(APIView):
     View for registering and unregistering APNS devices for push notifications.
     """
 
+    permission_classes = [IsAuthenticated]
+
     @extend_schema(
         request=inline_serializer(
             name="APNSDeviceTokenRequest",
@@ -42,7 +61,7 @@ class APNSView(APIView):
             ),
         },
     )
-    def post(self, request):
+    async def post(self, request):
         user = request.user
         token = request.data.get("token")
         if not token:
@@ -51,14 +70,12 @@ class APNSView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        if hasattr(user, "apns_token") and user.apns_token is not None:
-            user.apns_token.token = token
-            user.apns_token.save()
+        if await UserAPNSToken.objects.filter(user=user).aupdate(token=token):
             return Response(
                 {"message": "Device token updated successfully."},
                 status=status.HTTP_200_OK,
             )
-        UserAPNSToken.objects.create(user=user, token=token)
+        await UserAPNSToken.objects.acreate(user=user, token=token)
         return Response(
             {"message": "Device token registered successfully."},
             status=status.HTTP_200_OK,
@@ -68,6 +85,8 @@ class APNSView(APIView):
 class DeleteUserView(APIView):
     # Commonly known as "delete-account".  This will remove the user from the system (and their associated Account object if they have one).
 
+    permission_classes = [IsAuthenticated]
+
     @extend_schema(
         request=inline_serializer(
             name="DeleteUserRequest",
@@ -78,11 +97,11 @@ class DeleteUserView(APIView):
             fields={"message": drf_serializers.CharField()},
         ),
     )
-    def post(self, request):
+    async def post(self, request):
         payload = request.data
         confirm = payload.get("confirm")
         if not confirm or confirm != "yes":
             msg = "Key 'confirm' is required. Must be set to 'yes'"
             raise ValidationError(msg)
-        self.request.user.delete()
+        await self.request.user.adelete()
         return Response({"message": "Account deleted successfully."})